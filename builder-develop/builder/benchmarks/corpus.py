@@ -0,0 +1,160 @@
+"""
+Synthetic page corpora for the render benchmarks.
+
+Every generator returns `(blocks, components)` where `blocks` is a list of block dicts with roughly
+`size` blocks in total and `components` maps component names to the block tree they need.
+"""
+
+from collections.abc import Callable
+
+SIZES = (10, 100, 1000, 10000)
+
+
+def make_block(block_id: str, element: str = "div", **kwargs) -> dict:
+	block = {
+		"blockId": block_id,
+		"element": element,
+		"baseStyles": {"display": "flex", "padding": "8px", "color": "#333"},
+		"mobileStyles": {"padding": "4px"},
+		"tabletStyles": {},
+		"rawStyles": {},
+		"attributes": {},
+		"customAttributes": {},
+		"classes": [],
+		"props": {},
+		"children": [],
+	}
+	block.update(kwargs)
+	return block
+
+
+def make_body(children: list[dict]) -> list[dict]:
+	return [make_block("body", "body", children=children)]
+
+
+def flat(size: int) -> tuple[list[dict], dict]:
+	"""All blocks are direct children of body"""
+	children = [
+		make_block(f"b{i}", "p", innerHTML=f"Paragraph {i}", baseStyles={"fontSize": f"{12 + i % 8}px"})
+		for i in range(size - 1)
+	]
+	return make_body(children), {}
+
+
+def deep_nested(size: int) -> tuple[list[dict], dict]:
+	"""Binary tree of nested containers with text leaves"""
+
+	def make_subtree(block_id: str, budget: int) -> dict:
+		if budget <= 1:
+			return make_block(block_id, "span", innerHTML="Leaf")
+		left = budget // 2
+		children = [
+			make_subtree(f"{block_id}-{i}", child_budget)
+			for i, child_budget in enumerate((left, budget - 1 - left))
+			if child_budget
+		]
+		return make_block(block_id, "section", children=children)
+
+	return make_body([make_subtree("n", max(size - 1, 1))]), {}
+
+
+def repeater_heavy(size: int) -> tuple[list[dict], dict]:
+	"""Repeaters over page data, each with a small card template"""
+	repeaters = []
+	for i in range(max((size - 1) // 4, 1)):
+		card = make_block(
+			f"card{i}",
+			children=[
+				make_block(
+					f"title{i}",
+					"h3",
+					innerHTML="Title",
+					dynamicValues=[
+						{"key": "title", "type": "key", "property": "innerHTML", "comesFrom": "dataScript"}
+					],
+				),
+				make_block(
+					f"link{i}",
+					"a",
+					innerHTML="Read more",
+					attributes={"href": "#"},
+					dynamicValues=[
+						{"key": "url", "type": "attribute", "property": "href", "comesFrom": "dataScript"}
+					],
+				),
+			],
+		)
+		repeaters.append(
+			make_block(
+				f"repeater{i}",
+				isRepeaterBlock=True,
+				dataKey={"key": "items", "type": "key", "property": "", "comesFrom": "dataScript"},
+				children=[card],
+			)
+		)
+	return make_body(repeaters), {}
+
+
+def component_heavy(size: int) -> tuple[list[dict], dict]:
+	"""Instances of a 5 block card component"""
+	component_name = "benchmark-card"
+	component_block = make_block(
+		"card",
+		children=[
+			make_block("card-image", "img", attributes={"src": "/files/card.png", "alt": "Card"}),
+			make_block("card-title", "h3", innerHTML="Card title"),
+			make_block("card-text", "p", innerHTML="Some <b>card</b> text"),
+			make_block("card-link", "a", innerHTML="Open", attributes={"href": "#"}),
+		],
+	)
+
+	instances = []
+	for i in range(max((size - 1) // 5, 1)):
+		instances.append(
+			make_block(
+				f"instance{i}",
+				extendedFromComponent=component_name,
+				baseStyles={"margin": f"{i % 4}px"},
+				mobileStyles={},
+				children=[
+					make_block(
+						f"instance{i}-{child['blockId']}",
+						referenceBlockId=child["blockId"],
+						element=None,
+						baseStyles={},
+						mobileStyles={},
+						innerHTML=f"Card {i}" if child["blockId"] == "card-title" else None,
+					)
+					for child in component_block["children"]
+				],
+			)
+		)
+	return make_body(instances), {component_name: component_block}
+
+
+def inner_html_heavy(size: int) -> tuple[list[dict], dict]:
+	"""Rich text blocks with inline markup and fonts"""
+	children = [
+		make_block(
+			f"rich{i}",
+			innerHTML=(
+				f"<p>Paragraph <b>{i}</b> with <a href='/page?id={i}&amp;ref=bench'>a link</a>, "
+				"<span style='font-family: Inter'>custom font</span> &amp; <i>entities</i>&nbsp;</p>"
+			),
+		)
+		for i in range(size - 1)
+	]
+	return make_body(children), {}
+
+
+CORPORA: dict[str, Callable[[int], tuple[list[dict], dict]]] = {
+	"flat": flat,
+	"deep_nested": deep_nested,
+	"repeater_heavy": repeater_heavy,
+	"component_heavy": component_heavy,
+	"inner_html_heavy": inner_html_heavy,
+}
+
+
+def count_blocks(blocks: list[dict]) -> int:
+	return sum(1 + count_blocks(block.get("children") or []) for block in blocks)
@@ -0,0 +1,110 @@
+"""
+Micro-benchmark for `extend_block` over synthetic wide and deep component trees.
+
+Compares the current implementation with the previous one, which parsed the component for every
+instance, matched overridden children with a linear scan and deep-copied every matched child.
+
+	python -m builder.benchmarks.extend_block
+"""
+
+import copy
+import json
+import timeit
+
+import frappe
+
+from builder.builder.doctype.builder_page.builder_page import extend_block, get_block_overlay
+
+SHAPES = {
+	"wide (1 x 500)": (500, 1),
+	"wide (1 x 2000)": (2000, 1),
+	"deep (2 x 8)": (2, 8),
+	"mixed (20 x 3)": (20, 3),
+}
+
+
+def make_component_block(width: int, depth: int, block_id: str = "root") -> dict:
+	block = {
+		"blockId": block_id,
+		"element": "div",
+		"baseStyles": {"display": "flex", "padding": "10px"},
+		"mobileStyles": {},
+		"tabletStyles": {},
+		"rawStyles": {},
+		"attributes": {},
+		"customAttributes": {},
+		"classes": [],
+		"props": {},
+		"innerHTML": "Lorem ipsum",
+		"children": [],
+	}
+	if depth:
+		block["children"] = [make_component_block(width, depth - 1, f"{block_id}-{i}") for i in range(width)]
+	return block
+
+
+def make_instance_block(component_block: dict) -> dict:
+	"""Page block extending the component, overriding every child (in reverse order)"""
+	return {
+		"blockId": f"instance-{component_block['blockId']}",
+		"referenceBlockId": component_block["blockId"],
+		"baseStyles": {"color": "red"},
+		"mobileStyles": {},
+		"tabletStyles": {},
+		"attributes": {},
+		"classes": [],
+		"children": [make_instance_block(child) for child in reversed(component_block["children"])],
+	}
+
+
+def legacy_extend_block(block, overridden_block):
+	block["baseStyles"].update(overridden_block["baseStyles"])
+	block["mobileStyles"].update(overridden_block["mobileStyles"])
+	block["tabletStyles"].update(overridden_block["tabletStyles"])
+	block["attributes"].update(overridden_block["attributes"])
+	block["classes"].extend(overridden_block["classes"])
+	component_children = block.get("children", []) or []
+	extended_children = []
+	for overridden_child in overridden_block.get("children", []) or []:
+		component_child = next(
+			(
+				child
+				for child in component_children
+				if child.get("blockId")
+				in [overridden_child.get("blockId"), overridden_child.get("referenceBlockId")]
+			),
+			None,
+		)
+		if component_child:
+			extended_children.append(legacy_extend_block(copy.deepcopy(component_child), overridden_child))
+		else:
+			extended_children.append(overridden_child)
+	block["children"] = extended_children
+	return block
+
+
+def run(repeat: int = 5):
+	print(f"{'shape':<18}{'blocks':>8}{'legacy (ms)':>14}{'current (ms)':>14}{'speedup':>10}")
+	for name, (width, depth) in SHAPES.items():
+		component_block = frappe.parse_json(json.dumps(make_component_block(width, depth)))
+		component_json = json.dumps(component_block)
+		instance = make_instance_block(component_block)
+		blocks = sum(width**level for level in range(depth + 1))
+
+		legacy = min(
+			timeit.repeat(
+				lambda: legacy_extend_block(frappe.parse_json(component_json), instance),
+				number=1,
+				repeat=repeat,
+			)
+		)
+		current = min(
+			timeit.repeat(
+				lambda: extend_block(get_block_overlay(component_block), instance), number=1, repeat=repeat
+			)
+		)
+		print(f"{name:<18}{blocks:>8}{legacy * 1000:>14.2f}{current * 1000:>14.2f}{legacy / current:>9.1f}x")
+
+
+if __name__ == "__main__":
+	run()
@@ -0,0 +1,195 @@
+"""
+Benchmarks for the block rendering pipeline.
+
+Generates page corpora (see `builder.benchmarks.corpus`) and reports, per corpus and size:
+block compile time (`get_block_html`), Jinja template compile and render time, warm
+`BuilderPage.get_context` time, peak memory of a cold compile + render and output sizes.
+
+Runs offline against a local test site, everything it creates is rolled back:
+
+	bench --site test_site execute builder.benchmarks.render.run
+	bench --site test_site execute builder.benchmarks.render.run --kwargs "{'corpora': ['flat'], 'sizes': [100, 1000], 'output': '/tmp/render.json'}"
+
+Pass the json written by an earlier run as `baseline` to print the relative change.
+"""
+
+import json
+import time
+import tracemalloc
+from collections.abc import Callable
+
+import frappe
+
+from builder.benchmarks.corpus import CORPORA, SIZES, count_blocks
+from builder.builder.doctype.builder_page import builder_page
+
+ITEMS = [{"title": f"Item {i}", "url": f"/items/{i}"} for i in range(20)]
+PAGE_DATA_SCRIPT = f"data.update({{'items': {json.dumps(ITEMS)}}})"
+
+
+def run(
+	corpora: list[str] | None = None,
+	sizes: list[int] | None = None,
+	repeat: int = 3,
+	output: str | None = None,
+	baseline: str | None = None,
+):
+	baseline_results = {}
+	if baseline:
+		with open(baseline) as f:
+			baseline_results = {(r["corpus"], r["size"]): r for r in json.load(f)}
+
+	results = []
+	print_header()
+	try:
+		for corpus in corpora or CORPORA:
+			for size in sizes or SIZES:
+				result = benchmark_corpus(corpus, int(size), int(repeat))
+				results.append(result)
+				print_result(result, baseline_results.get((corpus, int(size))))
+		print_to_jinja_literal_throughput()
+	finally:
+		# components created for the corpora
+		frappe.db.rollback()
+
+	if output:
+		with open(output, "w") as f:
+			json.dump(results, f, indent=1)
+
+
+def benchmark_corpus(corpus: str, size: int, repeat: int = 3) -> dict:
+	blocks, components = CORPORA[corpus](size)
+	create_components(components)
+	blocks_json = json.dumps(blocks)
+	jenv = frappe.get_jenv()
+
+	compile_time = best_of(repeat, lambda: compile_blocks(blocks_json))
+	content, style, _, _ = builder_page.get_block_html(blocks_json)
+
+	template_time = best_of(repeat, lambda: jenv.from_string(content))
+	template = jenv.from_string(content)
+
+	context = frappe._dict(items=ITEMS)
+	render_time = best_of(repeat, lambda: template.render(context))
+	html = template.render(context)
+
+	page = frappe.get_doc(
+		{
+			"doctype": "Builder Page",
+			"name": f"benchmark-{corpus}-{size}",
+			"page_title": "Benchmark",
+			"route": f"benchmark/{corpus}/{size}",
+			"blocks": blocks_json,
+			"page_data_script": PAGE_DATA_SCRIPT,
+		}
+	)
+	page.get_context(frappe._dict(favicon=None))
+	context_time = best_of(repeat, lambda: page.get_context(frappe._dict(favicon=None)))
+
+	# a cold compile, nothing memoized by the timing runs above
+	clear_render_caches()
+	peak_memory = get_peak_memory(
+		lambda: jenv.from_string(builder_page.get_block_html(blocks_json)[0]).render(context)
+	)
+
+	return {
+		"corpus": corpus,
+		"size": size,
+		"blocks": count_blocks(blocks),
+		"compile_ms": compile_time * 1000,
+		"template_ms": template_time * 1000,
+		"render_ms": render_time * 1000,
+		"get_context_ms": context_time * 1000,
+		"peak_memory_mb": peak_memory / (1024 * 1024),
+		"template_kb": (len(content) + len(style)) / 1024,
+		"html_kb": len(html) / 1024,
+	}
+
+
+def create_components(components: dict):
+	for name, block in components.items():
+		if frappe.db.exists("Builder Component", name):
+			continue
+		frappe.get_doc(
+			{
+				"doctype": "Builder Component",
+				"component_id": name,
+				"component_name": name,
+				"block": json.dumps(block),
+			}
+		).insert(ignore_permissions=True)
+
+
+def compile_blocks(blocks_json: str):
+	# measure a full compile, not subtree memo hits
+	builder_page.block_subtree_cache.clear()
+	return builder_page.get_block_html(blocks_json)
+
+
+def clear_render_caches():
+	for cache in (
+		builder_page.block_subtree_cache,
+		builder_page.component_registry,
+		builder_page.jinja_template_cache,
+		builder_page.block_html_cache,
+	):
+		cache.clear()
+
+
+def best_of(repeat: int, fn: Callable) -> float:
+	timings = []
+	for _ in range(max(repeat, 1)):
+		start = time.perf_counter()
+		fn()
+		timings.append(time.perf_counter() - start)
+	return min(timings)
+
+
+def get_peak_memory(fn: Callable) -> int:
+	tracemalloc.start()
+	try:
+		fn()
+		return tracemalloc.get_traced_memory()[1]
+	finally:
+		tracemalloc.stop()
+
+
+COLUMNS = (
+	("corpus", "{:<18}", 18),
+	("blocks", "{:>8}", 8),
+	("compile_ms", "{:>12.1f}", 12),
+	("template_ms", "{:>13.1f}", 13),
+	("render_ms", "{:>11.1f}", 11),
+	("get_context_ms", "{:>16.1f}", 16),
+	("peak_memory_mb", "{:>16.1f}", 16),
+	("template_kb", "{:>13.1f}", 13),
+	("html_kb", "{:>10.1f}", 10),
+)
+
+
+def print_header():
+	print(
+		"".join(name.rjust(width) if i else name.ljust(width) for i, (name, _, width) in enumerate(COLUMNS))
+	)
+
+
+def print_result(result: dict, baseline: dict | None = None):
+	print("".join(fmt.format(result[name]) for name, fmt, _ in COLUMNS))
+	if baseline:
+		changes = []
+		for name, _, _ in COLUMNS[2:]:
+			if baseline.get(name):
+				changes.append(f"{name} {(result[name] / baseline[name] - 1) * 100:+.0f}%")
+		print("  vs baseline: " + ", ".join(changes))
+
+
+def print_to_jinja_literal_throughput(count: int = 10000):
+	props = {
+		"title": "Hello 'world'",
+		"count": 42,
+		"enabled": True,
+		"items": ["a", "b", {"c": None}],
+		"dynamic": "{{ block.title }}",
+	}
+	elapsed = best_of(3, lambda: [builder_page.to_jinja_literal(props) for _ in range(count)])
+	print(f"to_jinja_literal: {count / elapsed:,.0f} props dicts/s")
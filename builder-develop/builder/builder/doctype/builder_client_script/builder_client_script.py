@@ -10,6 +10,8 @@ from frappe.modules.export_file import export_to_files
 from frappe.utils import get_files_path
 from jsmin import jsmin
 
+from builder.builder.doctype.builder_page.builder_page import clear_static_pages
+
 
 class BuilderClientScript(Document):
 	# begin: auto-generated types
@@ -33,6 +35,8 @@ class BuilderClientScript(Document):
 	def on_update(self):
 		self.update_script_file()
 		self.update_exported_script()
+		# pre-rendered pages link the previous script url
+		clear_static_pages()
 
 	def on_trash(self):
 		self.delete_script_file()
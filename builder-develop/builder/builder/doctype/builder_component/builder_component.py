@@ -12,7 +12,12 @@ from frappe.model.document import Document
 from frappe.modules.export_file import export_to_files
 from frappe.website.utils import clear_website_cache
 
-from builder.utils import Block
+from builder.builder.doctype.builder_page.builder_page import (
+	clear_static_pages,
+	component_registry,
+	get_component_dependants,
+)
+from builder.utils import Block, get_component_ids
 
 
 class BuilderComponent(Document):
@@ -35,20 +40,35 @@ class BuilderComponent(Document):
 			self.component_id = frappe.generate_hash(length=16)
 
 	def on_update(self):
-		self.queue_action("clear_page_cache")
+		component_registry.delete_where(lambda key: key[0] == self.name)
+		self.queue_action("clear_page_cache", update_dependants=self.has_nested_components_changed())
 		self.update_exported_component()
 
-	def clear_page_cache(self):
-		pages = frappe.get_all("Builder Page", filters={"published": 1}, fields=["name"])
+	def has_nested_components_changed(self) -> bool:
+		previous = self.get_doc_before_save()
+		if not previous or previous.block == self.block:
+			return False
+		return get_component_ids(previous.block) != get_component_ids(self.block)
+
+	def clear_page_cache(self, update_dependants=False):
+		page_names = get_component_dependants(self.name)
+		if update_dependants:
+			# pages using this component now use other nested components
+			for page_name in page_names:
+				frappe.get_doc("Builder Page", page_name).update_components()
+
+		if not page_names:
+			return
+		pages = frappe.get_all(
+			"Builder Page", filters={"name": ["in", page_names], "published": 1}, fields=["name", "route"]
+		)
 		for page in pages:
-			page_doc = frappe.get_cached_doc("Builder Page", page.name)
-			if page_doc.is_component_used(self.component_id):
-				clear_website_cache(page_doc.route)
+			clear_website_cache(page.route)
+			clear_static_pages(page.name)
 
 	def sync_component(self):
-		pages = frappe.get_all("Builder Page", fields=["name"])
-		for page in pages:
-			page_doc = frappe.get_cached_doc("Builder Page", page.name)
+		for page_name in get_component_dependants(self.name):
+			page_doc = frappe.get_doc("Builder Page", page_name)
 			if page_doc.is_component_used(self.component_id):
 				ComponentSyncer(page_doc).sync_component(self)
 
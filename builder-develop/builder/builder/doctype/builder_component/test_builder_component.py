@@ -1,9 +1,94 @@
 # Copyright (c) 2023, asdf and Contributors
 # See license.txt
 
-# import frappe
+import frappe
 from frappe.tests.utils import FrappeTestCase
 
+from builder.builder.doctype.builder_page.builder_page import (
+	component_registry,
+	extend_block_with_component,
+	get_component_block,
+	get_component_dependants,
+)
+from builder.builder.doctype.builder_settings.builder_settings import get_component_usage_count
+from builder.utils import Block
+
 
 class TestBuilderComponent(FrappeTestCase):
-	pass
+	def test_component_registry(self):
+		component = frappe.get_doc(
+			{
+				"doctype": "Builder Component",
+				"component_name": "Registry Test",
+				"block": Block(element="div", baseStyles={"color": "red"}).as_json(),
+			}
+		).insert()
+
+		try:
+			component_block = get_component_block(component.name)
+			self.assertIs(get_component_block(component.name), component_block)
+
+			# instances must not leak overrides into the shared tree
+			instance = Block(
+				element="div", extendedFromComponent=component.name, baseStyles={"color": "blue"}
+			)
+			extended = extend_block_with_component(frappe.parse_json(instance.as_json()))
+			self.assertEqual(extended["baseStyles"]["color"], "blue")
+			self.assertEqual(component_block["baseStyles"]["color"], "red")
+
+			component.block = Block(element="div", baseStyles={"color": "green"}).as_json()
+			component.save()
+			self.assertFalse(any(key[1][0] == component.name for key in component_registry._data))
+			self.assertEqual(get_component_block(component.name)["baseStyles"]["color"], "green")
+		finally:
+			component.delete()
+
+	def test_component_dependants(self):
+		inner = frappe.get_doc(
+			{
+				"doctype": "Builder Component",
+				"component_name": "Dependants Inner",
+				"block": Block(element="span").as_json(),
+			}
+		).insert()
+		outer = frappe.get_doc(
+			{
+				"doctype": "Builder Component",
+				"component_name": "Dependants Outer",
+				"block": Block(element="div").as_json(),
+			}
+		).insert()
+		page = frappe.get_doc(
+			{
+				"doctype": "Builder Page",
+				"page_title": "Component Dependants Test",
+				"published": 1,
+				"route": "/component-dependants-test",
+				"blocks": Block(
+					element="body", children=[Block(element="div", extendedFromComponent=outer.name)]
+				).as_json(wrap_in_array=True),
+			}
+		).insert()
+
+		try:
+			self.assertEqual([row.component for row in page.components], [outer.name])
+			self.assertEqual(get_component_dependants(outer.name), [page.name])
+			self.assertEqual(get_component_dependants(inner.name), [])
+			self.assertEqual(get_component_usage_count.__wrapped__(outer.name)["count"], 1)
+
+			# nesting a component into a used one makes the page depend on it too
+			outer.block = Block(
+				element="div", children=[Block(element="span", extendedFromComponent=inner.name)]
+			).as_json()
+			outer.save()
+			outer.clear_page_cache(update_dependants=True)
+			self.assertEqual(get_component_dependants(inner.name), [page.name])
+
+			page.blocks = Block(element="body").as_json(wrap_in_array=True)
+			page.save()
+			self.assertEqual(get_component_dependants(outer.name), [])
+			self.assertEqual(get_component_dependants(inner.name), [])
+		finally:
+			page.delete()
+			outer.delete()
+			inner.delete()
@@ -2,69 +2,202 @@
 # For license information, please see license.txt
 
 import copy
+import gzip
+import hashlib
+import json
 import os
 import re
 import shutil
+import time
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from typing import Any, Optional
 
 import bs4 as bs
 import frappe
 import frappe.utils
+from frappe.model import table_fields
 from frappe.modules import scrub
 from frappe.modules.export_file import export_to_files
-from frappe.utils import set_request
+from frappe.utils import cint, set_request
 from frappe.utils.caching import redis_cache
-from frappe.utils.jinja import render_template
 from frappe.website.page_renderers.document_page import DocumentPage
-from frappe.website.path_resolver import evaluate_dynamic_routes
 from frappe.website.path_resolver import resolve_path as original_resolve_path
-from frappe.website.serve import get_response_content
+from frappe.website.serve import get_response, get_response_content
 from frappe.website.utils import clear_cache
 from frappe.website.website_generator import WebsiteGenerator
-from jinja2.exceptions import TemplateSyntaxError
+from jinja2 import Template
+from jinja2.exceptions import TemplateError
+from werkzeug.exceptions import NotFound
+from werkzeug.routing import Map
 
 from builder.export_import_standard_page import export_page_as_standard
 from builder.hooks import builder_path
+from builder.html_builder import (
+	HTMLFragment,
+	HTMLSoup,
+	HTMLTag,
+	RawHTML,
+	get_fonts_from_html,
+	get_html_fragment,
+)
 from builder.html_preview_image import generate_preview
 from builder.utils import (
 	Block,
 	ColonRule,
+	LRUCache,
 	camel_case_to_kebab_case,
 	clean_data,
 	copy_img_to_asset_folder,
 	escape_single_quotes,
 	execute_script,
 	get_builder_page_preview_file_paths,
+	get_component_ids,
+	get_nested_component_ids,
 	get_template_assets_folder_path,
-	is_component_used,
+	prefetch_block_data,
 	split_styles,
 )
 
+try:
+	import brotli
+except ImportError:
+	brotli = None
+
 MOBILE_BREAKPOINT = 576
 TABLET_BREAKPOINT = 768
 DESKTOP_BREAKPOINT = 1024
 
+BLOCK_HTML_CACHE_PREFIX = "builder_block_html"
+BLOCK_HTML_CACHE_TTL = 24 * 60 * 60
+# page data script results, see `BuilderPage.get_cached_page_data`
+PAGE_DATA_CACHE_PREFIX = "builder_page_data"
+# redis hash of page name -> version of its pre-rendered html, see `BuilderPage.prerender_static_page`
+STATIC_PAGES_CACHE_KEY = "builder_static_pages"
+STATIC_PAGES_FOLDER = "builder_static_pages"
+# preferred first, `None` is the uncompressed fallback
+STATIC_PAGE_ENCODINGS = (("br", "index.html.br"), ("gzip", "index.html.gz"), (None, "index.html"))
+# stands in for the page content while streaming, see `BuilderPageRenderer.render_streaming`
+STREAM_CONTENT_PLACEHOLDER = "__builder_stream_content__"
+STREAM_CHUNK_SIZE = 16 * 1024
+CSRF_TOKEN_MARKER = "<!-- csrf_token -->"
+# changes whenever published routes do, see `get_route_index_version`
+ROUTE_INDEX_VERSION_KEY = "builder_route_index_version"
+# seconds a process trusts its route caches before checking the route index version again
+ROUTE_INDEX_VERSION_CHECK_INTERVAL = 5
+# upper bound for a cached route lookup, covers pages changed without `clear_route_cache`
+PAGE_ROUTE_CACHE_TTL = 5 * 60
+
+# process-local tier in front of redis for compiled blocks
+block_html_cache = LRUCache(maxsize=128)
+# compiled jinja code keyed by (page name, template hash), see `get_page_template`
+jinja_template_cache = LRUCache(maxsize=512)
+# block data script calls of the last render of a template with the seconds each took and whether
+# the render before made the same call, keyed like `jinja_template_cache`
+block_data_calls_cache = LRUCache(maxsize=512)
+# a prefetch worker runs `frappe.init` and opens its own db connection, which costs a few
+# milliseconds, so faster calls are left to the render itself
+BLOCK_DATA_PREFETCH_MIN_DURATION = 0.02
+# parsed component blocks keyed by (component name, modified), see `get_component_block`
+component_registry = LRUCache(maxsize=512)
+# compiled subtrees keyed by subtree hash and render context, see `build_tag_memoized`
+block_subtree_cache = LRUCache(maxsize=8192)
+# (route index version, checked at) per site, see `get_route_index_version`
+route_index_version = LRUCache(maxsize=64)
+# werkzeug maps of all dynamic routes keyed by route index version
+dynamic_route_maps = LRUCache(maxsize=4)
+# (page name or None, expires at) keyed by (route index version, path), see `find_page_with_path`
+page_route_cache = LRUCache(maxsize=4096)
+# components placed directly in a page keyed by (page name, modified), see `BuilderPage.get_component_ids`
+page_component_ids = LRUCache(maxsize=1024)
+# writes render artifacts off the request path, see `dump_render_artifacts`
+render_artifact_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="builder_render_artifacts")
+
 
 class BuilderPageRenderer(DocumentPage):
 	def can_render(self):
+		self.static_page_file = None
 		if page := find_page_with_path(self.path):
 			self.doctype = "Builder Page"
 			self.docname = page
 			self.validate_access()
+			self.static_page_file = get_static_page_file(page)
 			return True
 
-		for d in get_web_pages_with_dynamic_routes():
-			try:
-				if evaluate_dynamic_routes([ColonRule(f"/{d.route}", endpoint=d.name)], self.path):
-					self.doctype = "Builder Page"
-					self.docname = d.name
-					self.validate_access()
-					return True
-			except ValueError:
-				return False
+		if page := match_dynamic_route(self.path):
+			self.doctype = "Builder Page"
+			self.docname = page
+			self.validate_access()
+			return True
 
 		return False
 
+	def render(self):
+		if static_page_file := getattr(self, "static_page_file", None):
+			file_path, encoding = static_page_file
+			try:
+				with open(file_path, "rb") as f:
+					data = f.read()
+			except FileNotFoundError:
+				# superseded by a newer version in the meantime
+				return super().render()
+
+			headers = {"Vary": "Accept-Encoding", "X-From-Cache": "static"}
+			if encoding:
+				headers["Content-Encoding"] = encoding
+			return self.build_response(data, headers=headers)
+
+		if self.should_stream():
+			return self.render_streaming()
+
+		return super().render()
+
+	def add_csrf_token(self, html):
+		# pre-rendered html is served to every guest, it must not carry the token of the render
+		if frappe.flags.builder_prerender:
+			return html.replace(CSRF_TOKEN_MARKER, "")
+		return super().add_csrf_token(html)
+
+	def should_stream(self) -> bool:
+		request = getattr(frappe.local, "request", None)
+		if not request or request.method != "GET" or getattr(request, "for_preview", False):
+			return False
+		if not frappe.get_cached_value("Builder Settings", "Builder Settings", "stream_page_response"):
+			return False
+		# static pages are served from the website cache in one piece
+		doc = getattr(self, "doc", None)
+		return bool(doc) and not doc.is_static_page()
+
+	def render_streaming(self):
+		"""
+		Same steps as `DocumentPage.get_html`, but the page content is rendered while the response
+		is sent: `<head>` goes out first and the body follows in chunks.
+		"""
+		self.doc = frappe.get_doc(self.doctype, self.docname)
+		self.init_context()
+		self.context.stream_content = True
+		self.update_context()
+		self.post_process_context()
+
+		csrf_token = self.add_csrf_token(CSRF_TOKEN_MARKER)
+
+		def chunks():
+			# templates are bound to the jinja environment they are created in, and the content is
+			# rendered in the site context of `stream_with_site_context`, not in the request's one
+			page_template = frappe.get_template(self.template_path)
+			content_template = get_page_template(self.docname, self.context.content_template_source)
+			for chunk in generate_page_chunks(page_template, content_template, self.context):
+				yield chunk.replace(CSRF_TOKEN_MARKER, csrf_token)
+
+		# same headers as a regular page response, only the body is streamed
+		response = self.build_response("", self.http_status_code)
+		response.response = stream_with_site_context(chunks())
+		response.headers.pop("Content-Length", None)
+		# let nginx pass chunks through instead of buffering the whole response
+		response.headers["X-Accel-Buffering"] = "no"
+		return response
+
 	def validate_access(self):
 		if self.docname:
 			self.doc = frappe.get_cached_doc(self.doctype, self.docname)
@@ -78,7 +211,7 @@ class BuilderPageRenderer(DocumentPage):
 		if self.doc.is_home_page():
 			context["canonical_url"] = frappe.utils.get_url()
 		elif self.doc.canonical_url:
-			context["canonical_url"] = render_template(self.doc.canonical_url, context)
+			context["canonical_url"] = render_page_template(self.doc.name, self.doc.canonical_url, context)
 		else:
 			context["canonical_url"] = frappe.utils.get_url(self.path)
 		self.context = context
@@ -99,6 +232,9 @@ class BuilderPage(WebsiteGenerator):
 		from builder.builder.doctype.builder_page_client_script.builder_page_client_script import (
 			BuilderPageClientScript,
 		)
+		from builder.builder.doctype.builder_page_component.builder_page_component import (
+			BuilderPageComponent,
+		)
 
 		app: DF.Literal[None]
 		authenticated_access: DF.Check
@@ -106,6 +242,7 @@ class BuilderPage(WebsiteGenerator):
 		body_html: DF.Code | None
 		canonical_url: DF.Data | None
 		client_scripts: DF.TableMultiSelect[BuilderPageClientScript]
+		components: DF.Table[BuilderPageComponent]
 		disable_indexing: DF.Check
 		draft_blocks: DF.LongText | None
 		dynamic_route: DF.Check
@@ -116,6 +253,8 @@ class BuilderPage(WebsiteGenerator):
 		language: DF.Data | None
 		meta_description: DF.SmallText | None
 		meta_image: DF.AttachImage | None
+		page_data_cache_keys: DF.Data | None
+		page_data_cache_ttl: DF.Int
 		page_data_script: DF.Code | None
 		page_name: DF.Data | None
 		page_title: DF.Data | None
@@ -143,6 +282,20 @@ class BuilderPage(WebsiteGenerator):
 		self.set_preview()
 		self.set_default_values()
 
+	def validate(self):
+		if self.has_value_changed("blocks") or self.has_value_changed("draft_blocks"):
+			self.set_components()
+
+	def set_components(self):
+		"""Index the components used by the page, see `get_component_dependants`"""
+		component_ids = get_component_ids(self.blocks) | get_component_ids(self.draft_blocks)
+		self.set("components", [{"component": component_id} for component_id in sorted(component_ids)])
+
+	def update_components(self):
+		"""Re-index the components used by the page without saving it"""
+		self.set_components()
+		self.update_child_table("components")
+
 	def process_blocks(self):
 		for block_type in ["blocks", "draft_blocks"]:
 			if isinstance(getattr(self, block_type), list):
@@ -179,6 +332,8 @@ class BuilderPage(WebsiteGenerator):
 			or self.has_value_changed("blocks")
 		):
 			self.clear_route_cache()
+		elif self.has_published_changes():
+			clear_static_pages(self.name)
 
 		if self.has_value_changed("published") and not self.published:
 			# если это главная страница, то очищаем главную страницу из настроек builder
@@ -193,10 +348,38 @@ class BuilderPage(WebsiteGenerator):
 
 	def clear_route_cache(self):
 		get_web_pages_with_dynamic_routes.clear_cache()
-		find_page_with_path.clear_cache()
+		get_page_with_path.clear_cache()
+		bump_route_index_version()
 		clear_cache(self.route)
+		jinja_template_cache.delete_where(lambda key: key[0] == self.name)
+		block_data_calls_cache.delete_where(lambda key: key[0] == self.name)
+		clear_static_pages(self.name)
+		frappe.cache.delete_keys(f"{PAGE_DATA_CACHE_PREFIX}:{self.name}:")
+
+	def has_published_changes(self) -> bool:
+		# draft edits and preview updates do not change the published html, neither does the
+		# components index, which also lists the components of the draft
+		for df in self.meta.fields:
+			if df.fieldname in ("draft_blocks", "preview", "components"):
+				continue
+			if df.fieldtype in table_fields:
+				changed = self.has_table_value_changed(df.fieldname)
+			else:
+				changed = self.has_value_changed(df.fieldname)
+			if changed:
+				return True
+		return False
+
+	def has_table_value_changed(self, fieldname: str) -> bool:
+		# child rows are documents, which compare by identity, so compare their values instead
+		previous = self.get_doc_before_save()
+		if not previous:
+			return True
+		return get_table_values(previous, fieldname) != get_table_values(self, fieldname)
 
 	def on_trash(self):
+		self.clear_route_cache()
+		shutil.rmtree(get_static_page_path(self.name), ignore_errors=True)
 		if self.is_template and frappe.conf.developer_mode:
 			page_template_folder = os.path.join(
 				frappe.get_app_path("builder"), "builder", "builder_page_template", scrub(str(self.name))
@@ -223,6 +406,8 @@ class BuilderPage(WebsiteGenerator):
 		if route_variables:
 			for k, v in frappe.parse_json(route_variables or "{}").items():
 				frappe.form_dict[k] = v
+		# changed pages are rendered again by `on_update`, see `clear_static_pages`
+		republished = self.published and not self.draft_blocks
 		self.published = 1
 		if self.draft_blocks:
 			self.blocks = self.draft_blocks
@@ -235,6 +420,14 @@ class BuilderPage(WebsiteGenerator):
 			queue="short",
 			enqueue_after_commit=True,
 		)
+		if republished and not frappe.cache.hget(STATIC_PAGES_CACHE_KEY, self.name) and self.is_static_page():
+			frappe.enqueue_doc(
+				self.doctype,
+				self.name,
+				"prerender_static_page",
+				queue="short",
+				enqueue_after_commit=True,
+			)
 
 		return self.route
 
@@ -247,17 +440,21 @@ class BuilderPage(WebsiteGenerator):
 		# удаляем favicon по умолчанию
 		del context.favicon
 		context.disable_indexing = self.disable_indexing
-		page_data = self.get_page_data()
+		page_data = self.get_cached_page_data()
 		if page_data.get("title"):
 			context.title = page_data.get("page_title")
 
-		blocks = self.blocks
+		blocks_field = "blocks"
 		context.preview = getattr(getattr(frappe.local, "request", None), "for_preview", None)
 
 		if context.preview and self.draft_blocks:
-			blocks = self.draft_blocks
+			blocks_field = "draft_blocks"
 
-		content, style, fonts, has_block_script = get_block_html(blocks)
+		content, style, fonts, has_block_script = get_cached_block_html(
+			self.get(blocks_field),
+			page_name=self.name,
+			cache_key=self.get_block_html_cache_key(blocks_field),
+		)
 
 		if self.dynamic_route or page_data or has_block_script:
 			context.no_cache = 1
@@ -265,7 +462,7 @@ class BuilderPage(WebsiteGenerator):
 		self.set_custom_font(context, fonts)
 		context.fonts = fonts
 		context.__content = content
-		context.style = render_template(style, page_data)
+		context.style = render_page_template(self.name, style, page_data)
 		context.editor_link = f"/{builder_path}/page/{self.name}"
 		if frappe.form_dict and self.dynamic_route:
 			query_string = "&".join(
@@ -290,10 +487,14 @@ class BuilderPage(WebsiteGenerator):
 		self.set_favicon(context)
 		self.set_language(context)
 		context.page_data = clean_data(context.page_data)
-		try:
-			context["__content"] = render_template(context.__content, context)
-		except TemplateSyntaxError:
-			raise
+		if context.get("stream_content"):
+			# rendered while the response is sent, see `BuilderPageRenderer.render_streaming`
+			# compiled here so that template errors are thrown before the response is started
+			get_page_template(self.name, context.__content)
+			context.content_template_source = context.__content
+			context["__content"] = STREAM_CONTENT_PLACEHOLDER
+		else:
+			context["__content"] = render_page_template(self.name, context.__content, context)
 
 	def set_meta_tags(self, context, page_data=None):
 		if not page_data:
@@ -322,10 +523,27 @@ class BuilderPage(WebsiteGenerator):
 			)
 
 	def is_component_used(self, component_id):
-		if self.blocks and is_component_used(self.blocks, component_id):
-			return True
-		elif self.draft_blocks and is_component_used(self.draft_blocks, component_id):
-			return True
+		return component_id in self.get_component_ids()
+
+	def get_component_ids(self):
+		"""
+		Components used in the saved published and draft blocks, including components nested inside them.
+
+		Blocks are parsed once per page version, nested components are resolved from the (separately
+		invalidated) component cache on every call.
+		"""
+		if self.is_new():
+			return get_component_ids(self.blocks) | get_component_ids(self.draft_blocks)
+
+		key = (self.name, str(self.modified))
+		component_ids = page_component_ids.get(key)
+		if component_ids is None:
+			component_ids = frozenset(
+				get_component_ids(self.blocks, nested=False)
+				| get_component_ids(self.draft_blocks, nested=False)
+			)
+			page_component_ids.set(key, component_ids)
+		return get_nested_component_ids(component_ids)
 
 	def set_style_and_script(self, context):
 		builder_settings = frappe.get_cached_doc("Builder Settings", "Builder Settings")
@@ -358,8 +576,8 @@ class BuilderPage(WebsiteGenerator):
 		if self.body_html:
 			context._body_html += self.body_html
 
-		context["_head_html"] = render_template(context._head_html, context)
-		context["_body_html"] = render_template(context._body_html, context)
+		context["_head_html"] = render_page_template(self.name, context._head_html, context)
+		context["_body_html"] = render_page_template(self.name, context._body_html, context)
 
 	@frappe.whitelist()
 	def get_page_data(self, route_variables=None):
@@ -377,6 +595,35 @@ class BuilderPage(WebsiteGenerator):
 
 		return page_data
 
+	def get_cached_page_data(self):
+		"""
+		`get_page_data` kept in redis for `page_data_cache_ttl` seconds. Route variables and the query
+		params listed in `page_data_cache_keys` are part of the key, so each route gets its own data.
+		"""
+		if not (self.page_data_script and self.page_data_cache_ttl):
+			return self.get_page_data()
+		if getattr(getattr(frappe.local, "request", None), "for_preview", None):
+			return self.get_page_data()
+
+		cache_key = self.get_page_data_cache_key()
+		page_data = frappe.cache.get_value(cache_key)
+		if page_data is None:
+			page_data = self.get_page_data()
+			frappe.cache.set_value(cache_key, page_data, expires_in_sec=self.page_data_cache_ttl)
+		return page_data
+
+	def get_page_data_cache_key(self) -> str:
+		keys = get_route_variables(self.route) if self.dynamic_route else []
+		keys += [key.strip() for key in (self.page_data_cache_keys or "").split(",") if key.strip()]
+		values = {key: frappe.form_dict.get(key) for key in keys}
+
+		# saving the page changes `modified`, so stale data is never served for a new script
+		key_data = frappe.as_json(
+			[str(self.modified), frappe.session.user, getattr(frappe.local, "lang", None), values],
+			indent=None,
+		)
+		return f"{PAGE_DATA_CACHE_PREFIX}:{self.name}:{hashlib.sha256(key_data.encode()).hexdigest()}"
+
 	def generate_page_preview_image(self, html=None):
 		public_path, local_path = get_builder_page_preview_file_paths(self)
 		if not html:
@@ -390,6 +637,44 @@ class BuilderPage(WebsiteGenerator):
 		)
 		self.db_set("preview", public_path, commit=True, update_modified=False)
 
+	def is_static_page(self) -> bool:
+		"""Page renders the same html for every guest request and can be served from disk"""
+		if self.dynamic_route or self.page_data_script or self.authenticated_access:
+			return False
+		*_, has_block_script = get_cached_block_html(
+			self.blocks, page_name=self.name, cache_key=self.get_block_html_cache_key()
+		)
+		return not has_block_script
+
+	def prerender_static_page(self):
+		if not (self.published and self.is_static_page()):
+			return
+
+		# render exactly what a guest would get
+		user = frappe.session.user
+		frappe.set_user("Guest")
+		frappe.flags.builder_prerender = True
+		try:
+			set_request(method="GET", path=self.route)
+			response = get_response()
+		finally:
+			frappe.flags.builder_prerender = False
+			frappe.set_user(user)
+
+		if response.status_code == 200:
+			write_static_page(self.name, response.get_data())
+
+	def get_block_html_cache_key(self, blocks_field: str = "blocks") -> str:
+		"""
+		Key of the compiled html of saved blocks that does not need the blocks to be parsed: the page
+		version and the versions of all components it uses (see `set_components`).
+		"""
+		key = hashlib.sha256(f"{self.name}:{blocks_field}:{self.modified}".encode())
+		for row in self.components:
+			modified = frappe.get_cached_value("Builder Component", row.component, "modified")
+			key.update(f"{row.component}:{modified}".encode())
+		return key.hexdigest()
+
 	def set_custom_font(self, context, font_map):
 		user_fonts = frappe.get_all(
 			"User Font",
@@ -405,14 +690,15 @@ class BuilderPage(WebsiteGenerator):
 		if self.blocks:
 			blocks = frappe.parse_json(self.blocks)
 			self.blocks = frappe.as_json(replace_component_in_blocks(blocks, target_component, replace_with))
-			self.db_set("blocks", self.blocks, commit=True, update_modified=False)
+			self.db_set("blocks", self.blocks, commit=True)
 		if self.draft_blocks:
 			draft_blocks = frappe.parse_json(self.draft_blocks)
 			self.draft_blocks = frappe.as_json(
 				replace_component_in_blocks(draft_blocks, target_component, replace_with)
 			)
-			self.db_set("draft_blocks", self.draft_blocks, commit=True, update_modified=False)
+			self.db_set("draft_blocks", self.draft_blocks, commit=True)
 
+		self.update_components()
 		self.clear_route_cache()
 
 	def is_home_page(self):
@@ -503,6 +789,333 @@ def get_block_data(block_id, block_data_script, props):
 	return block_data
 
 
+def render_page_template(page_name: str, template: str, context: dict) -> str:
+	"""
+	Render a page template like `frappe.utils.jinja.render_template` but reuse the compiled template
+	code, so repeated requests only pay for rendering and not for parsing.
+	"""
+	if not template:
+		return ""
+
+	compiled = get_page_template(page_name, template)
+	try:
+		with block_data_prefetch(compiled):
+			return compiled.render(context)
+	except TemplateError:
+		throw_template_error(template)
+
+
+def get_page_template(page_name: str, template: str) -> Template:
+	"""
+	Only the compiled code is shared between requests. The template itself is bound to the jinja
+	environment of the current request, whose globals hold the session user, form dict, csrf token etc.
+	"""
+	cache_key = (page_name, hashlib.sha256(template.encode()).hexdigest())
+	jenv = frappe.get_jenv()
+	code = jinja_template_cache.get(cache_key)
+	if code is None:
+		if ".__" in template:
+			frappe.throw(frappe._("Illegal template"))
+		try:
+			code = jenv.compile(template)
+		except TemplateError:
+			throw_template_error(template)
+		jinja_template_cache.set(cache_key, code)
+
+	compiled = jenv.template_class.from_code(jenv, code, jenv.make_globals(None))
+	# see `block_data_prefetch`
+	compiled.builder_cache_key = cache_key
+	return compiled
+
+
+def throw_template_error(template: str):
+	frappe.throw(
+		title="Jinja Template Error",
+		msg=f"<pre>{frappe.utils.escape_html(template)}</pre><pre>{frappe.get_traceback()}</pre>",
+	)
+
+
+def generate_page_chunks(page_template: Template, content_template: Template, context: dict) -> Iterator[str]:
+	"""
+	Render the page template with the content template in place of the content placeholder.
+
+	Everything before the content (the whole `<head>`) is sent as the first chunk, the content
+	follows in chunks of roughly `STREAM_CHUNK_SIZE` characters.
+	"""
+	buffer = []
+	for chunk in page_template.generate(context):
+		if STREAM_CONTENT_PLACEHOLDER not in chunk:
+			buffer.append(chunk)
+			continue
+
+		head, tail = chunk.split(STREAM_CONTENT_PLACEHOLDER, 1)
+		buffer.append(head)
+		yield "".join(buffer)
+
+		buffer, size = [], 0
+		with block_data_prefetch(content_template):
+			for content_chunk in content_template.generate(context):
+				buffer.append(content_chunk)
+				size += len(content_chunk)
+				if size >= STREAM_CHUNK_SIZE:
+					yield "".join(buffer)
+					buffer, size = [], 0
+		buffer.append(tail)
+
+	yield "".join(buffer)
+
+
+@contextmanager
+def block_data_prefetch(template: Template):
+	"""
+	Run the block data scripts called by the previous renders of `template` concurrently before it
+	is rendered again, and record the calls of this render for the next one.
+
+	Props of a block data script are only known while rendering (they can be passed down or come
+	from data), so the calls are learned from earlier renders: the first render of a template in a
+	process prefetches nothing, and only calls made with the same props by the last two renders are
+	prefetched, so calls whose props change between renders are not run twice. Other calls, and calls
+	faster than `BLOCK_DATA_PREFETCH_MIN_DURATION` last time, simply run inline.
+
+	Workers do not share connections (see `prefetch_block_data`), each prefetched call opens one.
+	"""
+	workers = cint(
+		frappe.get_cached_value("Builder Settings", "Builder Settings", "block_data_script_workers")
+	)
+	if not workers:
+		yield
+		return
+
+	cache_key = template.builder_cache_key
+	previous_calls = block_data_calls_cache.get(cache_key, {})
+	calls = [
+		call
+		for call, (duration, stable) in previous_calls.items()
+		if stable and duration >= BLOCK_DATA_PREFETCH_MIN_DURATION
+	]
+	# a single call gains nothing from another thread
+	frappe.local.builder_block_data_prefetched = prefetch_block_data(calls, workers) if len(calls) > 1 else {}
+	frappe.local.builder_block_data_calls = recorded_calls = {}
+	try:
+		yield
+	finally:
+		frappe.local.builder_block_data_calls = None
+		frappe.local.builder_block_data_prefetched = {}
+	block_data_calls_cache.set(
+		cache_key, {call: (duration, call in previous_calls) for call, duration in recorded_calls.items()}
+	)
+
+
+def stream_with_site_context(chunks: Iterator[str]) -> Iterator[str]:
+	"""
+	Frappe releases the request locals (db connection, session) once the view returns, but block
+	data scripts and template globals used by the content still need them while it is streamed.
+	"""
+	site, sites_path = frappe.local.site, frappe.local.sites_path
+	user = frappe.session.user
+	request, form_dict = frappe.local.request, frappe._dict(frappe.local.form_dict)
+
+	def generate():
+		initialized = False
+		if getattr(frappe.local, "site", None) != site or not frappe.db:
+			frappe.init(site, sites_path=sites_path)
+			frappe.connect()
+			frappe.set_user(user)
+			frappe.local.request = request
+			frappe.local.form_dict = form_dict
+			initialized = True
+
+		try:
+			yield from chunks
+		except Exception:
+			# headers are already sent, the response just ends here
+			frappe.log_error(title="Builder Page Streaming Error")
+			if initialized:
+				# nothing else commits the site context opened here
+				frappe.db.commit()
+		finally:
+			if initialized:
+				frappe.destroy()
+
+	return generate()
+
+
+def get_cached_block_html(
+	blocks: str | list, page_name: str | None = None, cache_key: str | None = None
+) -> tuple[str, str, dict, bool]:
+	"""
+	Same as `get_block_html` but compiled output is memoized in a process-local LRU and in redis.
+
+	Saved pages pass `BuilderPage.get_block_html_cache_key`, other blocks are keyed by their content
+	(see `get_block_html_cache_key`). Either way editing the blocks or any of the components they use
+	yields a new key.
+	"""
+	cache_key = cache_key or get_block_html_cache_key(blocks)
+
+	compiled = block_html_cache.get(cache_key)
+	if compiled is None:
+		compiled = frappe.cache.get_value(f"{BLOCK_HTML_CACHE_PREFIX}:{cache_key}")
+		if compiled is None:
+			compiled = get_block_html(blocks)
+			frappe.cache.set_value(
+				f"{BLOCK_HTML_CACHE_PREFIX}:{cache_key}", compiled, expires_in_sec=BLOCK_HTML_CACHE_TTL
+			)
+			dump_render_artifacts(page_name or "_", cache_key, compiled)
+		block_html_cache.set(cache_key, compiled)
+
+	content, style, font_map, has_block_script = compiled
+	# font map is modified by the caller (see `BuilderPage.set_custom_font`)
+	return content, style, copy.deepcopy(font_map), has_block_script
+
+
+def dump_render_artifacts(page_name: str, version: str, compiled: tuple[str, str, dict, bool]):
+	"""
+	Write compiled page templates to `<builder_render_artifacts_path>/<page>/<version>/` for debugging.
+
+	Off unless `builder_render_artifacts_path` is set in site config (relative paths are resolved
+	against the site directory). Files are written in a background thread.
+	"""
+	artifacts_path = frappe.conf.builder_render_artifacts_path
+	if not artifacts_path:
+		return
+
+	content, style, font_map, has_block_script = compiled
+	path = frappe.get_site_path(artifacts_path, scrub(page_name), version)
+	artifacts = {
+		"content.html": content,
+		"style.css": style,
+		"meta.json": json.dumps({"fonts": font_map, "has_block_script": has_block_script}, indent=1),
+	}
+	render_artifact_executor.submit(write_render_artifacts, path, artifacts)
+
+
+def write_render_artifacts(path: str, artifacts: dict[str, str]):
+	if os.path.exists(path):
+		return
+	try:
+		os.makedirs(path, exist_ok=True)
+		for file_name, data in artifacts.items():
+			with open(os.path.join(path, file_name), "w") as f:
+				f.write(data)
+	except OSError:
+		# debugging aid only, never let it affect rendering
+		pass
+
+
+def get_static_page_path(page_name: str, *parts: str) -> str:
+	return frappe.get_site_path(STATIC_PAGES_FOLDER, scrub(page_name), *parts)
+
+
+def write_static_page(page_name: str, html: bytes):
+	"""
+	Store pre-rendered html (with compressed variants) under a content-addressed version directory
+	and point the page to it. Older versions of the page are removed.
+	"""
+	version = hashlib.sha256(html).hexdigest()[:16]
+	path = get_static_page_path(page_name, version)
+	if not os.path.exists(path):
+		files = {"index.html": html, "index.html.gz": gzip.compress(html, compresslevel=9, mtime=0)}
+		if brotli:
+			files["index.html.br"] = brotli.compress(html)
+
+		# write to a temporary directory first so a version is never served half written
+		tmp_path = f"{path}.{frappe.generate_hash(length=8)}.tmp"
+		os.makedirs(tmp_path)
+		for file_name, data in files.items():
+			with open(os.path.join(tmp_path, file_name), "wb") as f:
+				f.write(data)
+		try:
+			os.rename(tmp_path, path)
+		except OSError:
+			# written by a concurrent job
+			shutil.rmtree(tmp_path, ignore_errors=True)
+
+	frappe.cache.hset(STATIC_PAGES_CACHE_KEY, page_name, version)
+
+	page_path = get_static_page_path(page_name)
+	for entry in os.listdir(page_path):
+		if entry != version:
+			shutil.rmtree(os.path.join(page_path, entry), ignore_errors=True)
+
+
+def get_static_page_file(page_name: str) -> tuple[str, str | None] | None:
+	"""Path and content encoding of the pre-rendered html to serve for the current request, if any"""
+	request = getattr(frappe.local, "request", None)
+	if (
+		not request
+		or request.method != "GET"
+		or request.query_string
+		or getattr(request, "for_preview", False)
+		or frappe.session.user != "Guest"
+	):
+		return None
+
+	version = frappe.cache.hget(STATIC_PAGES_CACHE_KEY, page_name)
+	if not version:
+		return None
+
+	for encoding, file_name in STATIC_PAGE_ENCODINGS:
+		if encoding and not request.accept_encodings[encoding]:
+			continue
+		file_path = get_static_page_path(page_name, version, file_name)
+		if os.path.exists(file_path):
+			return file_path, encoding
+
+	return None
+
+
+def get_table_values(doc, fieldname: str) -> list[dict]:
+	return [row.as_dict(no_default_fields=True) for row in doc.get(fieldname)]
+
+
+def clear_static_pages(page_name: str | None = None):
+	"""
+	Stop serving the pre-rendered html of a page (or of all pages) and render it again in the
+	background once the change is committed.
+	"""
+	if page_name:
+		frappe.cache.hdel(STATIC_PAGES_CACHE_KEY, page_name)
+	else:
+		frappe.cache.delete_value(STATIC_PAGES_CACHE_KEY)
+
+	frappe.enqueue(
+		"builder.builder.doctype.builder_page.builder_page.prerender_static_pages",
+		queue="short",
+		page_names=[page_name] if page_name else None,
+		enqueue_after_commit=True,
+	)
+
+
+def prerender_static_pages(page_names: list[str] | None = None):
+	"""Pre-render the given (or all) published pages, pages which are not static are skipped"""
+	if page_names is None:
+		page_names = frappe.get_all(
+			"Builder Page", filters={"published": 1, "dynamic_route": 0}, pluck="name"
+		)
+
+	for page_name in page_names:
+		# deleted or renamed since the job was enqueued
+		if not frappe.db.exists("Builder Page", page_name):
+			continue
+		try:
+			frappe.get_doc("Builder Page", page_name).prerender_static_page()
+		except Exception:
+			frappe.log_error(title=f"Builder Static Page Error: {page_name}")
+
+
+def get_block_html_cache_key(blocks: str | list) -> str:
+	"""Hash of the blocks JSON and the `modified` timestamps of every component used by the blocks"""
+	if not isinstance(blocks, str):
+		blocks = frappe.as_json(blocks, indent=0)
+
+	key = hashlib.sha256(blocks.encode())
+	for component_id in sorted(get_component_ids(blocks)):
+		modified = frappe.get_cached_value("Builder Component", component_id, "modified")
+		key.update(f"{component_id}:{modified}".encode())
+
+	return key.hexdigest()
+
+
 def get_block_html(blocks: str | list) -> tuple[str, str, dict, bool]:
 	"""
 	Основная точка входа для преобразования блоков в HTML.
@@ -517,7 +1130,10 @@ def get_block_html(blocks: str | list) -> tuple[str, str, dict, bool]:
 	if not isinstance(blocks, list):
 		blocks = [blocks]
 
-	soup = bs.BeautifulSoup("", "html.parser")
+	if frappe.get_cached_value("Builder Settings", "Builder Settings", "use_fast_html_renderer"):
+		soup = HTMLSoup()
+	else:
+		soup = bs.BeautifulSoup("", "html.parser")
 	style_tag = soup.new_tag("style")
 	font_map = {}
 
@@ -530,6 +1146,12 @@ def get_block_html(blocks: str | list) -> tuple[str, str, dict, bool]:
 		"standard_props_stack": {},  # prop_name -> список prop_info
 		"global_script_tag": soup.new_tag("script"),
 		"used_block_scripts": set(),
+		"style_classes": set(),
+		"style_rules": {},  # style class -> css rules
+		# subtree memoization, see `build_tag_memoized`
+		"subtree_hashes": get_subtree_hashes(blocks),
+		"memo_context": (type(soup).__name__, get_components_version(blocks)),
+		"effect_logs": [],
 	}
 
 	html_parts = []
@@ -539,22 +1161,20 @@ def get_block_html(blocks: str | list) -> tuple[str, str, dict, bool]:
 		props = process_block_props(block, None, shared_state["standard_props_stack"])
 		block_context = get_block_context(block, props)
 
-		shared_state["has_block_script"] = block_context["block_data_script"] is not None
+		if block_context["block_data_script"]:
+			apply_render_effect(shared_state, ("block_script",))
 
 		tag = build_tag(block, shared_state)
 		# Добавляем глобальный скрипт в начало
 		tag.insert(0, shared_state["global_script_tag"])
 
 		html = wrap_html_with_context(str(tag), block_context)
-		# Записываем HTML в файл для отладки
-		with open("output.html", "w") as f:
-			f.write(html)
 		html_parts.append(html)
 
 	return "".join(html_parts), str(style_tag), font_map, shared_state["has_block_script"]
 
 
-def build_tag(block: dict, state: dict, data_key: dict | None = None) -> bs.Tag:
+def build_tag(block: dict, state: dict, data_key: dict | None = None) -> bs.Tag | HTMLTag:
 	"""
 	Преобразует один блок в HTML тег.
 
@@ -584,12 +1204,123 @@ def build_tag(block: dict, state: dict, data_key: dict | None = None) -> bs.Tag:
 	return tag
 
 
+def build_tag_memoized(
+	block: dict, state: dict, data_key: dict | None = None, subtree_hash: str | None = None
+) -> bs.Tag | HTMLTag | RawHTML | HTMLFragment:
+	"""
+	Same as `build_tag` but the result is memoized per subtree, so editing one block only
+	recompiles the blocks on its path to the root.
+
+	Apart from the subtree itself the output depends on the data key and the standard props
+	stack it is rendered with, and on the used components. Side effects on the shared state
+	(styles, fonts, scripts) are recorded while building and replayed on a hit.
+	"""
+	if not subtree_hash:
+		return build_tag(block, state, data_key)
+
+	props_stack = state["standard_props_stack"]
+	cache_key = (subtree_hash, repr(data_key), repr(props_stack), state["memo_context"])
+
+	cached = block_subtree_cache.get(cache_key)
+	if cached is None:
+		state["effect_logs"].append([])
+		try:
+			html = str(build_tag(block, state, data_key))
+		finally:
+			effects = state["effect_logs"].pop()
+		exit_props_stack = {name: list(stack) for name, stack in props_stack.items()}
+		cached = (html, tuple(effects), exit_props_stack)
+		block_subtree_cache.set(cache_key, cached)
+
+		# already applied, only record for the enclosing subtree
+		if state["effect_logs"]:
+			state["effect_logs"][-1].extend(effects)
+	else:
+		html, effects, exit_props_stack = cached
+		for effect in effects:
+			apply_render_effect(state, effect)
+		props_stack.clear()
+		props_stack.update({name: list(stack) for name, stack in exit_props_stack.items()})
+
+	if isinstance(state["soup"], HTMLSoup):
+		return HTMLFragment(((False, html),))
+	return RawHTML(html)
+
+
+def get_subtree_hashes(blocks: list) -> dict[int, str]:
+	"""Content hash of every block subtree, keyed by `id()` of the block"""
+	hashes = {}
+
+	def get_hash(block: dict) -> str:
+		# repr is much faster than json and is stable for blocks parsed from the same JSON
+		own_fields = dict(block)
+		own_fields.pop("children", None)
+		key = hashlib.sha256(repr(own_fields).encode())
+		for child in block.get("children") or []:
+			if isinstance(child, dict):
+				key.update(get_hash(child).encode())
+		hashes[id(block)] = key.hexdigest()
+		return hashes[id(block)]
+
+	for block in blocks:
+		if isinstance(block, dict):
+			get_hash(block)
+
+	return hashes
+
+
+def get_components_version(blocks: list) -> str:
+	components = sorted(
+		(component_id, str(frappe.get_cached_value("Builder Component", component_id, "modified")))
+		for component_id in get_component_ids(blocks)
+	)
+	return hashlib.sha256(json.dumps(components).encode()).hexdigest()
+
+
+def apply_render_effect(state: dict, effect: tuple):
+	"""
+	Apply a side effect of rendering a block to the shared state and record it for the subtrees
+	being memoized (see `build_tag_memoized`).
+	"""
+	kind = effect[0]
+	if kind == "font":
+		_, font, weight = effect
+		font_map = state["font_map"]
+		if font in font_map:
+			if weight and weight not in font_map[font]["weights"]:
+				font_map[font]["weights"].append(weight)
+				font_map[font]["weights"].sort()
+		else:
+			font_map[font] = {"weights": [weight or "400"]}
+	elif kind == "html_font":
+		state["font_map"][effect[1]] = {"weights": ["400"]}
+	elif kind == "style":
+		_, style_class, rules = effect
+		if style_class not in state["style_classes"]:
+			state["style_classes"].add(style_class)
+			for rule in rules:
+				state["style_tag"].append(rule)
+	elif kind == "script":
+		_, script_unique_id, script = effect
+		if script_unique_id not in state["used_block_scripts"]:
+			state["global_script_tag"].append(
+				f"function client_script_{script_unique_id}(props) {{{script}}}\n"
+			)
+			state["used_block_scripts"].add(script_unique_id)
+	elif kind == "block_script":
+		state["has_block_script"] = True
+
+	if state["effect_logs"]:
+		state["effect_logs"][-1].append(effect)
+
+
 def get_block_context(block: dict, props: dict) -> dict:
 	"""
 	Получает контекст шаблона Jinja для блока.
 
 	#### Returns:
-		Словарь с ключами: { `all_props`, `passed_down_props`, `block_data_script` }
+		Словарь с ключами: { `all_props`, `passed_down_props`, `block_data_script`,
+		`block_data_script_cache`, `block_data_script_cache_ttl` }
 	"""
 	all_props = {name: info["value"] for name, info in props.items()}
 	passed_down_props = {name: info["value"] for name, info in props.items() if info["is_passed_down"]}
@@ -598,6 +1329,8 @@ def get_block_context(block: dict, props: dict) -> dict:
 		"all_props": all_props,
 		"passed_down_props": passed_down_props,
 		"block_data_script": block.get("blockDataScript"),
+		"block_data_script_cache": bool(block.get("cacheBlockDataScript")),
+		"block_data_script_cache_ttl": cint(block.get("blockDataScriptCacheTTL")),
 	}
 
 
@@ -679,7 +1412,7 @@ def get_dynamic_props_template(
 	return f"{{{{ {key} if {key} is defined else '{fallback}' }}}}"
 
 
-def create_html_tag(block: dict, state: dict) -> bs.Tag:
+def create_html_tag(block: dict, state: dict) -> bs.Tag | HTMLTag:
 	"""Create HTML tag element with attributes, classes, and styling."""
 	soup = state["soup"]
 
@@ -751,11 +1484,12 @@ def build_tag_classes(block: dict, state: dict) -> list[str]:
 
 
 def generate_and_apply_styles(block: dict, state: dict) -> str:
-	"""Generate a unique style class and append all styles to the style tag."""
-	style_class = f"fb-{frappe.generate_hash(length=8)}"
-	style_tag = state["style_tag"]
-	font_map = state["font_map"]
+	"""
+	Generate a style class and append its styles to the style tag.
 
+	The class name is derived from the block's styles, so blocks with identical styles share a
+	single class and a single set of rules, and the output is stable across renders.
+	"""
 	styles = {
 		"base": split_styles(block.get("baseStyles", {})),
 		"mobile": split_styles(block.get("mobileStyles", {})),
@@ -769,32 +1503,54 @@ def generate_and_apply_styles(block: dict, state: dict) -> str:
 		styles["tablet"]["regular"],
 		styles["raw"]["regular"],
 	]
-	set_fonts(style_list, font_map)
+	set_fonts(style_list, state)
+
+	style_class = get_style_class(styles)
+	rules = state["style_rules"].get(style_class)
+	if rules is None:
+		rules = []
+		# Добавляем стили для различных состояний и устройств
+		# Базовые и raw
+		append_style(styles["base"]["regular"], rules, style_class)
+		append_style(styles["raw"]["regular"], rules, style_class)
+		append_state_style(styles["raw"]["state"], rules, style_class)
+		append_state_style(styles["base"]["state"], rules, style_class)
+
+		# Планшет
+		append_style(styles["tablet"]["regular"], rules, style_class, device="tablet")
+		append_state_style(styles["tablet"]["state"], rules, style_class, device="tablet")
 
-	# Добавляем стили для различных состояний и устройств
-	# Базовые и raw
-	append_style(styles["base"]["regular"], style_tag, style_class)
-	append_style(styles["raw"]["regular"], style_tag, style_class)
-	append_state_style(styles["raw"]["state"], style_tag, style_class)
-	append_state_style(styles["base"]["state"], style_tag, style_class)
+		# Мобильный
+		append_style(styles["mobile"]["regular"], rules, style_class, device="mobile")
+		append_state_style(styles["mobile"]["state"], rules, style_class, device="mobile")
 
-	# Планшет
-	append_style(styles["tablet"]["regular"], style_tag, style_class, device="tablet")
-	append_state_style(styles["tablet"]["state"], style_tag, style_class, device="tablet")
+		rules = state["style_rules"][style_class] = tuple(rules)
 
-	# Мобильный
-	append_style(styles["mobile"]["regular"], style_tag, style_class, device="mobile")
-	append_state_style(styles["mobile"]["state"], style_tag, style_class, device="mobile")
+	apply_render_effect(state, ("style", style_class, rules))
 
 	return style_class
 
 
-def add_inner_html_content(tag: bs.Tag, block: dict, state: dict):
+def get_style_class(styles: dict) -> str:
+	"""Get a deterministic class name for a (split) style dict."""
+	normalized = frappe.as_json(styles, indent=None, separators=(",", ":"))
+	return f"fb-{hashlib.sha256(normalized.encode()).hexdigest()[:12]}"
+
+
+def add_inner_html_content(tag: bs.Tag | HTMLTag, block: dict, state: dict):
 	"""Add inner HTML content to the tag."""
 	inner_content = block.get("innerHTML")
-	if inner_content:
+	if not inner_content:
+		return
+
+	if isinstance(tag, HTMLTag):
+		fragment = get_html_fragment(str(inner_content))
+		for font in fragment.fonts:
+			apply_render_effect(state, ("html_font", font))
+		tag.append(fragment)
+	else:
 		inner_soup = bs.BeautifulSoup(inner_content, "html.parser")
-		set_fonts_from_html(inner_soup, state["font_map"])
+		set_fonts_from_html(inner_soup, state)
 		tag.append(inner_soup)
 
 
@@ -803,40 +1559,44 @@ def is_repeater_block(block: dict) -> bool:
 	return bool(block.get("isRepeaterBlock") and block.get("children") and block.get("dataKey"))
 
 
-def render_children(tag: bs.Tag, block: dict, data_key: dict | None, state: dict):
+def render_children(tag: bs.Tag | HTMLTag, block: dict, data_key: dict | None, state: dict):
 	"""Render (non-repeater) children."""
 	for child in block.get("children", []) or []:
+		subtree_hash = state["subtree_hashes"].get(id(child))
 		child = extend_block_with_component(child)
 		child_props = process_block_props(child, data_key, state["standard_props_stack"])
 		child_context = get_block_context(child, child_props)
 		child_context["visibility_key"] = get_visibility_condition_key(child, data_key)
 
-		state["has_block_script"] = child_context["block_data_script"] is not None
+		if child_context["block_data_script"]:
+			apply_render_effect(state, ("block_script",))
 
-		child_tag = build_tag(child, state, data_key)
+		child_tag = build_tag_memoized(child, state, data_key, subtree_hash)
 
 		append_child_with_context(tag, child_tag, child_context)
 
 
-def render_repeater_children(tag: bs.Tag, block: dict, data_key: dict | None, state: dict):
+def render_repeater_children(tag: bs.Tag | HTMLTag, block: dict, data_key: dict | None, state: dict):
 	"""Render children for repeater blocks (with for loops)."""
 	loop_info = get_loop_info(block, data_key, state["standard_props_stack"])
 
 	tag.append(f"{{% for {loop_info['loop_var']} in {loop_info['iterator_key']} %}}")
 
 	child = block.get("children")[0]
+	subtree_hash = state["subtree_hashes"].get(id(child))
 	child = extend_block_with_component(child)
 
 	child_props = process_block_props(child, loop_info["data_key"], state["standard_props_stack"])
 	child_context = get_block_context(child, child_props)
 
-	state["has_block_script"] = child_context["block_data_script"] is not None
+	if child_context["block_data_script"]:
+		apply_render_effect(state, ("block_script",))
 
 	if block.get("dataKey", {}).get("comesFrom") == "props":
 		data_key_key = block.get("dataKey").get("key")
 		child_context["default_props"] = extract_loop_variables(data_key_key, state["standard_props_stack"])
 
-	child_tag = build_tag(child, state, loop_info["data_key"])
+	child_tag = build_tag_memoized(child, state, loop_info["data_key"], subtree_hash)
 
 	append_child_with_context(tag, child_tag, child_context)
 
@@ -929,7 +1689,7 @@ def get_visibility_condition_key(block: dict, data_key: dict | None) -> str | No
 		return key
 
 
-def attach_client_script(tag: bs.Tag, block: dict, state: dict):
+def attach_client_script(tag: bs.Tag | HTMLTag, block: dict, state: dict):
 	"""Attach client-side JavaScript to the block."""
 	script = block.get("blockClientScript")
 	if not script:
@@ -938,12 +1698,11 @@ def attach_client_script(tag: bs.Tag, block: dict, state: dict):
 	# Generate unique identifier for the script
 	script_unique_id = block.get("blockId")
 	if block.get("isBlockClientScriptOverridden"):
-		script_unique_id = frappe.generate_hash(length=8)
+		# derived from the script so that output stays stable across renders
+		script_unique_id = hashlib.sha256(f"{script_unique_id}:{script}".encode()).hexdigest()[:8]
 
 	# Add global function definition (only once)
-	if script_unique_id not in state["used_block_scripts"]:
-		state["global_script_tag"].append(f"function client_script_{script_unique_id}(props) {{{script}}}\n")
-		state["used_block_scripts"].add(script_unique_id)
+	apply_render_effect(state, ("script", script_unique_id, script))
 
 	# Add data attribute for selecting this specific block
 	tag.attrs["data-block-uid"] = "{{ unique_hash }}"
@@ -959,7 +1718,7 @@ def attach_client_script(tag: bs.Tag, block: dict, state: dict):
 	tag.append(local_script)
 
 
-def append_child_with_context(parent: bs.Tag, child: bs.Tag, context: dict):
+def append_child_with_context(parent: bs.Tag | HTMLTag, child: bs.Tag | HTMLTag, context: dict):
 	"""Append child tag with proper Jinja context wrapping."""
 	# Generate unique hash for this block instance
 	# This is unique for each block irrespective of loops or components
@@ -978,7 +1737,10 @@ def append_child_with_context(parent: bs.Tag, child: bs.Tag, context: dict):
 
 	if context.get("block_data_script"):
 		escaped_script = escape_single_quotes(context["block_data_script"])
-		parent.append(f"{{% with block = block | execute_script_and_combine('{escaped_script}', props) %}}")
+		cache_args = get_block_data_script_cache_args(context)
+		parent.append(
+			f"{{% with block = block | execute_script_and_combine('{escaped_script}', props{cache_args}) %}}"
+		)
 
 	if context.get("visibility_key"):
 		parent.append(f"{{% if {context['visibility_key']} %}}")
@@ -1057,6 +1819,15 @@ def get_dynamic_value_key(dynamic_value_doc: dict, original_key: str, data_key:
 		return key
 
 
+def get_block_data_script_cache_args(context: dict) -> str:
+	"""Extra `execute_script_and_combine` arguments for blocks that opted into data script caching."""
+	if context.get("block_data_script_cache_ttl"):
+		return f", cache_ttl={context['block_data_script_cache_ttl']}"
+	if context.get("block_data_script_cache"):
+		return ", cache=True"
+	return ""
+
+
 def wrap_html_with_context(html: str, context: dict) -> str:
 	"""
 	Wrap HTML with Jinja context variables.
@@ -1068,8 +1839,10 @@ def wrap_html_with_context(html: str, context: dict) -> str:
 	passed_down_literal = to_jinja_literal(context["passed_down_props"])
 
 	script_escaped = escape_single_quotes(context.get("block_data_script") or "")
+	cache_args = get_block_data_script_cache_args(context)
 	html = (
-		f"{{% with block = {{}} | execute_script_and_combine('{script_escaped}', {all_props_literal}) %}}"
+		"{% with block = {} | execute_script_and_combine("
+		f"'{script_escaped}', {all_props_literal}{cache_args}) %}}"
 		f"{html}"
 		f"{{% endwith %}}"
 	)
@@ -1085,19 +1858,54 @@ def extend_block_with_component(block: dict) -> dict:
 	if not block.get("extendedFromComponent"):
 		return block
 
+	component_block = get_component_block(block["extendedFromComponent"])
+	if component_block:
+		return extend_block(get_block_overlay(component_block), block)
+
+	return block
+
+
+def get_component_block(component_name: str) -> dict | None:
+	"""
+	Get the parsed block tree of a component.
+
+	Trees are parsed once per component version and shared across renders, so the returned
+	block must not be modified. Use `get_block_overlay` to get a block that can be.
+	"""
 	component = frappe.get_cached_value(
-		"Builder Component",
-		block["extendedFromComponent"],
-		["block", "name"],
-		as_dict=True,
+		"Builder Component", component_name, ["block", "modified"], as_dict=True
 	)
+	if not component:
+		return None
 
-	component_block = frappe.parse_json(component.block if component else "{}")
-	if component_block:
-		extend_block(component_block, block)
-		return component_block
+	cache_key = (component_name, str(component.modified))
+	component_block = component_registry.get(cache_key)
+	if component_block is None:
+		component_block = frappe.parse_json(component.block or "{}")
+		component_registry.set(cache_key, component_block)
+
+	return component_block
 
-	return block
+
+def get_block_overlay(block: dict) -> dict:
+	"""
+	Shallow copy of a block with fresh copies of the fields that rendering modifies in place.
+	Everything else (children, scripts, visibility etc.) is shared with the source block.
+	"""
+	overlay = frappe._dict(block)
+	for key in (
+		"baseStyles",
+		"mobileStyles",
+		"tabletStyles",
+		"rawStyles",
+		"attributes",
+		"customAttributes",
+		"props",
+		"dataKey",
+	):
+		overlay[key] = dict(block.get(key) or {})
+	overlay["classes"] = list(block.get("classes") or [])
+	return overlay
 
 
 def wrap_with_media_query(style_string, device):
@@ -1137,29 +1945,19 @@ def append_state_style(style_obj, style_tag, style_class, device="desktop"):
 			style_tag.append(wrap_with_media_query(style_string, device))
 
 
-def set_fonts(styles, font_map):
+def set_fonts(styles, state):
 	for style in styles:
 		font = style.get("fontFamily")
 		if font:
 			# escape spaces in font name
 			style["fontFamily"] = font.replace(" ", "\\ ")
-			if font in font_map:
-				if style.get("fontWeight") and style.get("fontWeight") not in font_map[font]["weights"]:
-					font_map[font]["weights"].append(style.get("fontWeight"))
-					font_map[font]["weights"].sort()
-			else:
-				font_map[font] = {"weights": [style.get("fontWeight") or "400"]}
+			apply_render_effect(state, ("font", font, style.get("fontWeight")))
 
 
-def set_fonts_from_html(soup, font_map):
+def set_fonts_from_html(soup, state):
 	# get font-family from inline styles
-	for tag in soup.find_all(style=True):
-		styles = tag.attrs.get("style").split(";")
-		for style in styles:
-			if "font-family" in style:
-				font = style.split(":")[1].strip()
-				if font:
-					font_map[font] = {"weights": ["400"]}
+	for font in get_fonts_from_html(soup):
+		apply_render_effect(state, ("html_font", font))
 
 
 def extend_block(block, overridden_block):
@@ -1168,7 +1966,7 @@ def extend_block(block, overridden_block):
 	block["tabletStyles"].update(overridden_block["tabletStyles"])
 	block["attributes"].update(overridden_block["attributes"])
 
-	dynamicValues = overridden_block.get("dynamicValues", [])
+	dynamicValues = list(overridden_block.get("dynamicValues", []) or [])
 	dynamicValuesProperties = [dv.get("property") for dv in dynamicValues]
 	for dv in block.get("dynamicValues", []) or []:
 		if dv.get("property") in dynamicValuesProperties:
@@ -1202,6 +2000,8 @@ def extend_block(block, overridden_block):
 
 	if overridden_block.get("blockDataScript"):
 		block["blockDataScript"] = overridden_block.get("blockDataScript")
+		block["cacheBlockDataScript"] = overridden_block.get("cacheBlockDataScript")
+		block["blockDataScriptCacheTTL"] = overridden_block.get("blockDataScriptCacheTTL")
 
 	dataKey = overridden_block.get("dataKey", {})
 	if not block.get("dataKey"):
@@ -1210,38 +2010,83 @@ def extend_block(block, overridden_block):
 		block["dataKey"].update({k: v for k, v in dataKey.items() if v is not None and v != ""})
 	if overridden_block.get("innerHTML"):
 		block["innerHTML"] = overridden_block["innerHTML"]
-	component_children = block.get("children", []) or []
+	component_children = get_children_index(block.get("children", []) or [])
 	overridden_children = overridden_block.get("children", []) or []
 	extended_children = []
 	for overridden_child in overridden_children:
-		component_child = next(
-			(
-				child
-				for child in component_children
-				if child.get("blockId")
-				in [
-					overridden_child.get("blockId"),
-					overridden_child.get("referenceBlockId"),
-				]
-			),
-			None,
-		)
+		component_child = find_component_child(component_children, overridden_child)
 		if component_child:
-			extended_children.append(extend_block(copy.deepcopy(component_child), overridden_child))
+			extended_children.append(extend_block(get_block_overlay(component_child), overridden_child))
 		else:
 			extended_children.append(overridden_child)
 	block["children"] = extended_children
 	return block
 
 
-@redis_cache(ttl=60 * 60)
+def get_children_index(children: list[dict]) -> dict[str | None, tuple[int, dict]]:
+	"""Map blockId to (position, child), keeping the first child for duplicate ids."""
+	index = {}
+	for position, child in enumerate(children):
+		index.setdefault(child.get("blockId"), (position, child))
+	return index
+
+
+def find_component_child(
+	children_index: dict[str | None, tuple[int, dict]], overridden_child: dict
+) -> dict | None:
+	"""Get the component child an overridden child refers to, by its blockId or referenceBlockId."""
+	matches = [
+		children_index[key]
+		for key in (overridden_child.get("blockId"), overridden_child.get("referenceBlockId"))
+		if key in children_index
+	]
+	if not matches:
+		return None
+	# same as picking the first matching child in component order
+	return min(matches, key=lambda match: match[0])[1]
+
+
 def find_page_with_path(route):
+	"""
+	Get the published page with this exact route.
+
+	Lookups are cached in the process, misses included, so most requests (and 404s) don't reach
+	redis or the database.
+	"""
+	key = (get_route_index_version(), route)
+	now = time.monotonic()
+	cached = page_route_cache.get(key)
+	if cached and cached[1] > now:
+		return cached[0]
+
+	page = get_page_with_path(route)
+	page_route_cache.set(key, (page, now + PAGE_ROUTE_CACHE_TTL))
+	return page
+
+
+@redis_cache(ttl=60 * 60)
+def get_page_with_path(route):
 	try:
 		return frappe.db.get_value("Builder Page", dict(route=route, published=1), "name", cache=True)
 	except frappe.DoesNotExistError:
 		pass
 
 
+def get_component_dependants(component_id: str) -> list[str]:
+	"""Names of the pages using the component (directly or nested in another one), from the page index"""
+	return frappe.get_all(
+		"Builder Page Component",
+		filters={"component": component_id, "parenttype": "Builder Page"},
+		pluck="parent",
+		distinct=True,
+	)
+
+
+def get_route_variables(route: str) -> list[str]:
+	"""Names of the variables in a dynamic route, e.g. `["slug"]` for `blog/:slug`"""
+	return re.findall(r"<(?:[^<>:]+:)?([^<>]+)>", ColonRule.convert_colon_to_brackets(route or ""))
+
+
 @redis_cache(ttl=60 * 60)
 def get_web_pages_with_dynamic_routes() -> list[BuilderPage]:
 	return frappe.get_all(
@@ -1252,14 +2097,78 @@ def get_web_pages_with_dynamic_routes() -> list[BuilderPage]:
 	)
 
 
+def get_dynamic_route_map() -> Map:
+	"""
+	Werkzeug `Map` of all published dynamic routes, so a path is matched against every route at once
+	instead of building a map per page. Built once per process and route index version.
+	"""
+	version = get_route_index_version()
+	route_map = dynamic_route_maps.get(version)
+	if route_map is None:
+		route_map = Map()
+		for d in get_web_pages_with_dynamic_routes():
+			try:
+				route_map.add(ColonRule(f"/{d.route}", endpoint=d.name))
+			except ValueError:
+				# invalid route, the page can't be matched
+				pass
+		dynamic_route_maps.set(version, route_map)
+	return route_map
+
+
+def match_dynamic_route(path: str) -> str | None:
+	"""
+	Get the page whose dynamic route matches the path, like `evaluate_dynamic_routes` does for a
+	list of rules. Route variables are added to `form_dict`.
+	"""
+	request = getattr(frappe.local, "request", None)
+	if not (request and request.environ):
+		return None
+
+	try:
+		page, args = get_dynamic_route_map().bind_to_environ(request.environ).match("/" + path)
+	except NotFound:
+		return None
+
+	if args:
+		frappe.local.no_cache = 1
+		frappe.local.form_dict.update(args)
+	return page
+
+
+def get_route_index_version() -> str:
+	"""
+	Version of the published routes that process-local route caches are keyed by.
+
+	Redis is asked at most every `ROUTE_INDEX_VERSION_CHECK_INTERVAL` seconds, so other processes
+	pick up `clear_route_cache` shortly after it runs.
+	"""
+	now = time.monotonic()
+	cached = route_index_version.get("version")
+	if cached and now - cached[1] < ROUTE_INDEX_VERSION_CHECK_INTERVAL:
+		return cached[0]
+
+	version = frappe.cache.get_value(ROUTE_INDEX_VERSION_KEY)
+	if version is None:
+		# redis was flushed, caches built before can't be trusted anymore
+		return bump_route_index_version()
+
+	route_index_version.set("version", (version, now))
+	return version
+
+
+def bump_route_index_version() -> str:
+	version = frappe.generate_hash(length=10)
+	frappe.cache.set_value(ROUTE_INDEX_VERSION_KEY, version)
+	route_index_version.set("version", (version, time.monotonic()))
+	return version
+
+
 def resolve_path(path):
 	try:
 		if find_page_with_path(path):
 			return path
-		elif evaluate_dynamic_routes(
-			[ColonRule(f"/{d.route}", endpoint=d.name) for d in get_web_pages_with_dynamic_routes()],
-			path,
-		):
+		elif match_dynamic_route(path):
 			return path
 	except Exception:
 		pass
@@ -1301,6 +2210,8 @@ def reset_block(block):
 	block["props"] = {}
 	block["blockClientScript"] = None
 	block["blockDataScript"] = None
+	block["cacheBlockDataScript"] = None
+	block["blockDataScriptCacheTTL"] = None
 	block["dynamicValues"] = []
 	return block
 
@@ -0,0 +1,7 @@
+import frappe
+
+
+def execute():
+	"""Index the components used by existing pages"""
+	for page_name in frappe.get_all("Builder Page", pluck="name"):
+		frappe.get_doc("Builder Page", page_name).update_components()
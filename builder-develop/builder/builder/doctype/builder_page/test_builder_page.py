@@ -96,6 +96,67 @@ class TestBuilderPage(FrappeTestCase):
 		content = get_html_for_route("/test-page-dynamic-route/123")
 		self.assertTrue("Dynamic Content!" in content)
 
+	def test_dynamic_route_index(self):
+		from frappe.utils import set_request
+
+		from builder.builder.doctype.builder_page.builder_page import match_dynamic_route
+
+		page = frappe.get_doc(
+			{
+				"doctype": "Builder Page",
+				"page_title": "Route Index Test",
+				"published": 1,
+				"route": "route-index-test/:category/:slug",
+				"blocks": Block(element="body").as_json(wrap_in_array=True),
+			}
+		).insert()
+		try:
+			set_request(method="GET", path="/route-index-test/news/hello")
+			self.assertEqual(match_dynamic_route("route-index-test/news/hello"), page.name)
+			self.assertEqual(frappe.form_dict.slug, "hello")
+			self.assertEqual(
+				match_dynamic_route("test-page-dynamic-route/123"), self.page_with_dynamic_route.name
+			)
+			self.assertIsNone(match_dynamic_route("route-index-test/news"))
+
+			# route changes rebuild the index
+			page.route = "route-index-test-renamed/:slug"
+			page.save()
+			self.assertIsNone(match_dynamic_route("route-index-test/news/hello"))
+			self.assertEqual(match_dynamic_route("route-index-test-renamed/hello"), page.name)
+		finally:
+			page.delete()
+		self.assertIsNone(match_dynamic_route("route-index-test-renamed/hello"))
+
+	def test_page_route_cache(self):
+		from unittest.mock import patch
+
+		from builder.builder.doctype.builder_page import builder_page
+
+		get_page_with_path = builder_page.get_page_with_path
+		with patch.object(builder_page, "get_page_with_path", wraps=get_page_with_path) as lookup:
+			# misses are cached as well
+			self.assertIsNone(builder_page.find_page_with_path("route-cache-test"))
+			self.assertIsNone(builder_page.find_page_with_path("route-cache-test"))
+			self.assertEqual(lookup.call_count, 1)
+
+			page = frappe.get_doc(
+				{
+					"doctype": "Builder Page",
+					"page_title": "Route Cache Test",
+					"published": 1,
+					"route": "route-cache-test",
+					"blocks": Block(element="body").as_json(wrap_in_array=True),
+				}
+			).insert()
+			try:
+				self.assertEqual(builder_page.find_page_with_path("route-cache-test"), page.name)
+				self.assertEqual(builder_page.find_page_with_path("route-cache-test"), page.name)
+				self.assertEqual(lookup.call_count, 2)
+			finally:
+				page.delete()
+			self.assertIsNone(builder_page.find_page_with_path("route-cache-test"))
+
 	def test_publish_unpublish(self):
 		self.page.unpublish()
 		from frappe.utils import get_html_for_route
@@ -772,6 +833,393 @@ class TestBuilderPage(FrappeTestCase):
 		finally:
 			page.delete()
 
+	def test_block_html_cache(self):
+		from unittest.mock import patch
+
+		from builder.builder.doctype.builder_page import builder_page
+
+		blocks = Block(element="body", children=[Block(element="h1", innerHTML="Cached")]).as_json(
+			wrap_in_array=True
+		)
+		cache_key = builder_page.get_block_html_cache_key(blocks)
+		builder_page.block_html_cache.clear()
+		frappe.cache.delete_value(f"{builder_page.BLOCK_HTML_CACHE_PREFIX}:{cache_key}")
+
+		with patch.object(
+			builder_page, "get_block_html", wraps=builder_page.get_block_html
+		) as compile_blocks:
+			first = builder_page.get_cached_block_html(blocks)
+			second = builder_page.get_cached_block_html(blocks)
+
+		self.assertEqual(compile_blocks.call_count, 1)
+		self.assertEqual(first, second)
+		self.assertTrue("Cached" in first[0])
+
+	def test_page_block_html_cache_key(self):
+		from unittest.mock import patch
+
+		from builder.builder.doctype.builder_page import builder_page
+
+		component = frappe.get_doc(
+			{
+				"doctype": "Builder Component",
+				"component_name": "Cache Key Test",
+				"block": Block(element="div", innerHTML="Before").as_json(),
+			}
+		).insert()
+		page = frappe.get_doc(
+			{
+				"doctype": "Builder Page",
+				"page_title": "Cache Key Test",
+				"route": "/cache-key-test",
+				"blocks": Block(
+					element="body", children=[Block(element="div", extendedFromComponent=component.name)]
+				).as_json(wrap_in_array=True),
+			}
+		).insert()
+
+		try:
+			# the key does not depend on parsing the blocks
+			with patch.object(builder_page, "get_component_ids") as get_component_ids:
+				cache_key = page.get_block_html_cache_key()
+				self.assertEqual(page.get_block_html_cache_key(), cache_key)
+			get_component_ids.assert_not_called()
+			self.assertNotEqual(page.get_block_html_cache_key("draft_blocks"), cache_key)
+
+			component.block = Block(element="div", innerHTML="After").as_json()
+			component.save()
+			self.assertNotEqual(page.get_block_html_cache_key(), cache_key)
+		finally:
+			page.delete()
+			component.delete()
+
+	def test_render_artifacts(self):
+		import os
+		import shutil
+		from unittest.mock import patch
+
+		from builder.builder.doctype.builder_page import builder_page
+
+		blocks = Block(element="body", children=[Block(element="h1", innerHTML="Artifacts")]).as_json(
+			wrap_in_array=True
+		)
+		cache_key = builder_page.get_block_html_cache_key(blocks)
+		artifacts_path = frappe.get_site_path("test_render_artifacts")
+
+		with patch.dict(frappe.conf, {"builder_render_artifacts_path": "test_render_artifacts"}):
+			builder_page.block_html_cache.clear()
+			frappe.cache.delete_value(f"{builder_page.BLOCK_HTML_CACHE_PREFIX}:{cache_key}")
+			builder_page.get_cached_block_html(blocks, page_name="artifact-page")
+			# wait for the background write
+			builder_page.render_artifact_executor.submit(lambda: None).result()
+
+		try:
+			with open(os.path.join(artifacts_path, "artifact-page", cache_key, "content.html")) as f:
+				self.assertTrue("Artifacts" in f.read())
+		finally:
+			shutil.rmtree(artifacts_path, ignore_errors=True)
+
+	def test_deterministic_style_classes(self):
+		from builder.builder.doctype.builder_page.builder_page import get_block_html
+
+		body = Block(element="body")
+		body.attach_children(
+			*[Block(element="div", baseStyles={"color": "green", "hover:color": "red"}) for _ in range(3)]
+		)
+		blocks = body.as_json(wrap_in_array=True)
+
+		content, style, _, _ = get_block_html(blocks)
+		self.assertEqual((content, style), get_block_html(blocks)[:2])
+		self.assertEqual(style.count("color: green;"), 1)
+		self.assertEqual(style.count(":hover"), 1)
+
+	def test_fast_html_renderer(self):
+		from builder.builder.doctype.builder_page.builder_page import get_block_html
+
+		body = Block(element="body", attributes={"title": "a & \"b\" 'c'"})
+		body.attach_children(
+			Block(element="h1", innerHTML="Hello <b style='font-family: Inter'>World</b> &amp; more"),
+			Block(element="img", attributes={"src": "/files/a.png", "darkSrc": "/files/b.png"}),
+			Block(element="p", innerHTML="a > b", blockClientScript="console.log('<x>')"),
+			Block(element="style", innerHTML="a > b { color: red; }"),
+		)
+		blocks = body.as_json(wrap_in_array=True)
+
+		settings = frappe.get_single("Builder Settings")
+		expected = get_block_html(blocks)
+		try:
+			settings.use_fast_html_renderer = 1
+			settings.save()
+			self.assertEqual(get_block_html(blocks), expected)
+		finally:
+			settings.use_fast_html_renderer = 0
+			settings.save()
+
+	def test_compiled_template_cache(self):
+		from builder.builder.doctype.builder_page import builder_page
+
+		template = "<h1>{{ title }}</h1>"
+		self.assertEqual(
+			builder_page.render_page_template(self.page.name, template, {"title": "One"}), "<h1>One</h1>"
+		)
+		self.assertEqual(
+			builder_page.render_page_template(self.page.name, template, {"title": "Two"}), "<h1>Two</h1>"
+		)
+		self.assertTrue(any(key[1][0] == self.page.name for key in builder_page.jinja_template_cache._data))
+
+		self.page.clear_route_cache()
+		self.assertFalse(any(key[1][0] == self.page.name for key in builder_page.jinja_template_cache._data))
+
+	def test_compiled_template_request_globals(self):
+		from builder.builder.doctype.builder_page import builder_page
+
+		template = "{{ frappe.session.user }}:{{ frappe.form_dict.x }}"
+		try:
+			for user, x in (("Administrator", "one"), ("Guest", "two")):
+				frappe.set_user(user)
+				frappe.local.form_dict = frappe._dict(x=x)
+				# every request gets its own jinja environment
+				frappe.local.jenv = None
+				self.assertEqual(
+					builder_page.render_page_template(self.page.name, template, {}), f"{user}:{x}"
+				)
+		finally:
+			frappe.set_user("Administrator")
+			frappe.local.form_dict = frappe._dict()
+			frappe.local.jenv = None
+
+	def test_subtree_memoization(self):
+		from unittest.mock import patch
+
+		from builder.builder.doctype.builder_page import builder_page
+
+		blocks = json.loads(
+			Block(
+				element="body",
+				children=[
+					Block(element="section", children=[Block(element="h1", innerHTML="First")]),
+					Block(
+						element="section",
+						children=[Block(element="h2", innerHTML="Second", baseStyles={"color": "red"})],
+					),
+				],
+			).as_json(wrap_in_array=True)
+		)
+		builder_page.block_subtree_cache.clear()
+		content, style, _, _ = builder_page.get_block_html(json.dumps(blocks))
+
+		blocks[0]["children"][0]["children"][0]["innerHTML"] = "Edited"
+		with patch.object(builder_page, "build_tag", wraps=builder_page.build_tag) as build_tag:
+			edited_content, edited_style, _, _ = builder_page.get_block_html(json.dumps(blocks))
+
+		# body, the edited section and its heading; the second section is reused
+		self.assertEqual(build_tag.call_count, 3)
+		self.assertEqual(edited_content, content.replace("First", "Edited"))
+		self.assertEqual(edited_style, style)
+
+	def test_streaming_response(self):
+		from frappe.utils import set_request
+		from frappe.website.serve import get_response
+
+		page = frappe.get_doc(
+			{
+				"doctype": "Builder Page",
+				"page_title": "Streaming Test",
+				"published": 1,
+				"route": "/streaming-test",
+				"page_data_script": page_data_script,
+				"blocks": Block(
+					element="body", children=[Block(element="h1", innerHTML="{{ name }}")]
+				).as_json(wrap_in_array=True),
+			}
+		).insert()
+		settings = frappe.get_single("Builder Settings")
+		settings.stream_page_response = 1
+		settings.save()
+		try:
+			set_request(method="GET", path="/streaming-test")
+			response = get_response()
+			self.assertTrue(response.is_streamed)
+			self.assertEqual(response.headers.get("X-Page-Name"), "streaming-test")
+			self.assertIsNone(response.headers.get("Content-Length"))
+
+			chunks = list(response.response)
+			self.assertTrue("</head>" in chunks[0])
+			self.assertFalse("John Doe" in chunks[0])
+			self.assertTrue("John Doe" in get_html_for("".join(chunks), "tag", "h1"))
+		finally:
+			settings.stream_page_response = 0
+			settings.save()
+			page.delete()
+
+	def test_static_page(self):
+		import gzip
+		import shutil
+		from unittest.mock import patch
+
+		from frappe.utils import set_request
+		from frappe.website.serve import get_response
+
+		from builder.builder.doctype.builder_page import builder_page
+
+		client_script = frappe.get_doc(
+			{"doctype": "Builder Client Script", "script_type": "JavaScript", "script": "console.log(1)"}
+		).insert()
+		page = frappe.get_doc(
+			{
+				"doctype": "Builder Page",
+				"page_title": "Static Page",
+				"published": 1,
+				"route": "/static-page-test",
+				"client_scripts": [{"builder_script": client_script.name}],
+				"blocks": Block(
+					element="body", children=[Block(element="h1", innerHTML="Static Content")]
+				).as_json(wrap_in_array=True),
+			}
+		).insert()
+		try:
+			self.assertTrue(page.is_static_page())
+			self.assertFalse(self.page_with_dynamic_route.is_static_page())
+
+			page.prerender_static_page()
+			version = frappe.cache.hget(builder_page.STATIC_PAGES_CACHE_KEY, page.name)
+			self.assertTrue(version)
+			with open(builder_page.get_static_page_path(page.name, version, "index.html.gz"), "rb") as f:
+				html = gzip.decompress(f.read())
+			self.assertTrue(b"Static Content" in html)
+			self.assertFalse(b"frappe.csrf_token =" in html)
+
+			frappe.set_user("Guest")
+			try:
+				set_request(method="GET", path="/static-page-test", headers={"Accept-Encoding": "gzip"})
+				response = get_response()
+			finally:
+				frappe.set_user("Administrator")
+			self.assertEqual(response.headers.get("X-From-Cache"), "static")
+			self.assertEqual(response.headers.get("Content-Encoding"), "gzip")
+
+			# draft edits keep the published html
+			page.draft_blocks = Block(element="body").as_json(wrap_in_array=True)
+			page.save()
+			self.assertEqual(frappe.cache.hget(builder_page.STATIC_PAGES_CACHE_KEY, page.name), version)
+
+			page.page_title = "Static Page Updated"
+			with patch("frappe.enqueue") as enqueue:
+				page.save()
+			self.assertFalse(frappe.cache.hget(builder_page.STATIC_PAGES_CACHE_KEY, page.name))
+			# rendered again once the change is committed
+			self.assertEqual(enqueue.call_args.kwargs["page_names"], [page.name])
+		finally:
+			page.delete()
+			client_script.delete()
+			shutil.rmtree(builder_page.get_static_page_path(page.name), ignore_errors=True)
+
+	def test_page_data_cache(self):
+		from unittest.mock import patch
+
+		from frappe.utils import get_html_for_route
+
+		from builder.builder.doctype.builder_page import builder_page
+
+		page = frappe.get_doc(
+			{
+				"doctype": "Builder Page",
+				"page_title": "Data Cache Test",
+				"published": 1,
+				"route": "/data-cache-test/:slug",
+				"dynamic_route": 1,
+				"page_data_script": 'data.update({"slug": frappe.form_dict.slug})',
+				"page_data_cache_ttl": 60,
+				"blocks": Block(
+					element="body", children=[Block(element="h1", innerHTML="Post {{ slug }}")]
+				).as_json(wrap_in_array=True),
+			}
+		).insert()
+		try:
+			with patch.object(builder_page, "execute_script", wraps=builder_page.execute_script) as execute:
+				self.assertTrue("Post first" in get_html_for_route("/data-cache-test/first"))
+				self.assertTrue("Post first" in get_html_for_route("/data-cache-test/first"))
+				# route variables are part of the key
+				self.assertTrue("Post second" in get_html_for_route("/data-cache-test/second"))
+				self.assertEqual(execute.call_count, 2)
+
+				# saving the page invalidates its data
+				page.page_data_script = 'data.update({"slug": frappe.form_dict.slug.upper()})'
+				page.save()
+				self.assertTrue("Post FIRST" in get_html_for_route("/data-cache-test/first"))
+		finally:
+			page.delete()
+
+	def test_block_data_prefetch(self):
+		from unittest.mock import patch
+
+		from builder.builder.doctype.builder_page import builder_page
+
+		body = Block(element="body")
+		for label in ("first", "second"):
+			block = Block(
+				element="h4",
+				innerHTML="Label",
+				blockDataScript='block.update({"label": props.label.upper()})',
+				props={
+					"label": {
+						"isDynamic": True,
+						"comesFrom": "dataScript",
+						"isPassedDown": False,
+						"value": label,
+						"isStandard": False,
+					},
+				},
+			)
+			block.set_dynamic_value("label", "key", "innerHTML", "blockDataScript")
+			body.attach_children(block)
+
+		page = frappe.get_doc(
+			{
+				"doctype": "Builder Page",
+				"page_title": "Block Data Prefetch Test",
+				"published": 1,
+				"route": "/block-data-prefetch-test",
+				"page_data_script": 'data.update({"first": "one", "second": "two"})',
+				"blocks": body.as_json(wrap_in_array=True),
+			}
+		).insert()
+		settings = frappe.get_single("Builder Settings")
+		settings.block_data_script_workers = 2
+		settings.save()
+
+		prefetch_block_data = builder_page.prefetch_block_data
+		prefetched = []
+
+		def record_prefetch(calls, max_workers):
+			prefetched.append(prefetch_block_data(calls, max_workers))
+			return prefetched[-1]
+
+		def render():
+			content = get_response_content("/block-data-prefetch-test")
+			self.assertEqual("ONE", get_html_for(content, "tag", "h4", only_content=True))
+			self.assertEqual("TWO", get_html_for(content, "tag", "h4", index=1, only_content=True))
+
+		try:
+			with patch.object(builder_page, "prefetch_block_data", side_effect=record_prefetch):
+				prefetch_counts = []
+				with patch.object(builder_page, "BLOCK_DATA_PREFETCH_MIN_DURATION", 0):
+					for _ in range(3):
+						render()
+						prefetch_counts.append(len(prefetched))
+				# the calls are unknown to the first render and made only once before the second one,
+				# the third render runs them up front
+				self.assertEqual(prefetch_counts, [0, 0, 1])
+				self.assertEqual(sorted(data.label for data, _ in prefetched[0].values()), ["ONE", "TWO"])
+
+				# too fast to be worth a worker
+				render()
+				self.assertEqual(len(prefetched), 1)
+		finally:
+			settings.block_data_script_workers = 0
+			settings.save()
+			page.delete()
+
 	@classmethod
 	def tearDownClass(cls):
 		cls.page.delete()
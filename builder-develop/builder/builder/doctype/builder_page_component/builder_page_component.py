@@ -0,0 +1,22 @@
+# Copyright (c) 2023, asdf and contributors
+# For license information, please see license.txt
+
+from frappe.model.document import Document
+
+
+class BuilderPageComponent(Document):
+	# begin: auto-generated types
+	# This code is auto-generated. Do not modify anything in this block.
+
+	from typing import TYPE_CHECKING
+
+	if TYPE_CHECKING:
+		from frappe.types import DF
+
+		component: DF.Data
+		parent: DF.Data
+		parentfield: DF.Data
+		parenttype: DF.Data
+	# end: auto-generated types
+
+	pass
@@ -6,6 +6,8 @@ from frappe.model.document import Document
 from frappe.utils import get_files_path
 from frappe.utils.caching import redis_cache
 
+from builder.builder.doctype.builder_page.builder_page import clear_static_pages
+
 
 class BuilderSettings(Document):
 	# begin: auto-generated types
@@ -17,6 +19,7 @@ class BuilderSettings(Document):
 		from frappe.types import DF
 
 		auto_convert_images_to_webp: DF.Check
+		block_data_script_workers: DF.Int
 		body_html: DF.Code | None
 		default_language: DF.Data | None
 		execute_block_scripts_in_editor: DF.Literal["Don't Execute", "Restricted", "Unrestricted"]
@@ -26,8 +29,10 @@ class BuilderSettings(Document):
 		restrict_click_handlers: DF.Check
 		script: DF.Code | None
 		script_public_url: DF.ReadOnly | None
+		stream_page_response: DF.Check
 		style: DF.Code | None
 		style_public_url: DF.ReadOnly | None
+		use_fast_html_renderer: DF.Check
 	# end: auto-generated types
 
 	def on_update(self):
@@ -35,6 +40,8 @@ class BuilderSettings(Document):
 		self.handle_script_update("style", "css", "css", "page_styles")
 		if self.has_value_changed("home_page"):
 			frappe.cache.delete_key("home_page")
+		# settings (head html, scripts, favicon etc.) are part of every page
+		clear_static_pages()
 
 	def handle_script_update(self, attribute, script_type, extension, folder_name):
 		if self.has_value_changed(attribute):
@@ -96,10 +103,7 @@ def replace_component(target_component: str, replace_with: str, filters=None):
 		"Builder Page",
 		fields=["name"],
 		filters=filters,
-		or_filters={
-			"blocks": ["like", f"%{target_component}%"],
-			"draft_blocks": ["like", f"%{target_component}%"],
-		},
+		or_filters=[["Builder Page Component", "component", "=", target_component]],
 	)
 	for page in pages:
 		doc = frappe.get_doc("Builder Page", page.name)
@@ -113,10 +117,7 @@ def get_component_usage_count(component_id: str, filters=None):
 		"Builder Page",
 		filters=filters,
 		fields=["name", "page_title", "route", "preview"],
-		or_filters={
-			"blocks": ["like", f"%{component_id}%"],
-			"draft_blocks": ["like", f"%{component_id}%"],
-		},
+		or_filters=[["Builder Page Component", "component", "=", component_id]],
 	)
 	return {
 		"count": len(pages),
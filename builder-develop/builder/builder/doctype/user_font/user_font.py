@@ -4,6 +4,13 @@
 # import frappe
 from frappe.model.document import Document
 
+from builder.builder.doctype.builder_page.builder_page import clear_static_pages
+
 
 class UserFont(Document):
-	pass
+	def on_update(self):
+		# pre-rendered pages embed the font css
+		clear_static_pages()
+
+	def on_trash(self):
+		clear_static_pages()
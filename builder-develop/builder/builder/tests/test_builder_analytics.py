@@ -0,0 +1,174 @@
+import glob
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import duckdb
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_to_date, cint
+
+from builder.builder_analytics import (
+	ANALYTICS_DB_FILE,
+	SNAPSHOT_DB_FILE_PATTERN,
+	DuckDBConnection,
+	DuckDBCursor,
+	_create_web_page_views_table,
+	_get_analytics_source,
+	_get_date_range,
+	_get_web_page_views_after,
+	_ingest_web_page_views,
+	_setup_watermark_table,
+	analytics_connections,
+	get_overall_analytics,
+	ingest_web_page_views_to_duckdb,
+)
+
+# far from any views of the test site, so date filtered queries only see the views of a test
+BASE_TIME = datetime(2001, 3, 1, 10)
+
+
+def insert_views(views):
+	"""Insert `(creation, path, referrer)` tuples as `Web Page View`s"""
+	for creation, path, referrer in views:
+		frappe.get_doc(
+			{
+				"doctype": "Web Page View",
+				"creation": creation,
+				"path": path,
+				"referrer": referrer,
+				"is_unique": "1" if referrer else "0",
+				"time_zone": "UTC",
+				"user_agent": "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) Mobile/15E148",
+			}
+		).db_insert()
+
+
+class TestBuilderAnalytics(FrappeTestCase):
+	def setUp(self):
+		self.analytics_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.analytics_dir, ignore_errors=True)
+		db_path = patch(
+			"builder.builder_analytics._get_analytics_db_path",
+			side_effect=lambda filename=ANALYTICS_DB_FILE: os.path.join(self.analytics_dir, filename),
+		)
+		db_path.start()
+		self.addCleanup(db_path.stop)
+		analytics_connections.clear()
+		self.addCleanup(analytics_connections.clear)
+
+	def get_ingested_count(self, condition="1=1"):
+		with DuckDBCursor() as db:
+			return db.execute(f"SELECT COUNT(*) FROM web_page_views WHERE {condition}").fetchone()[0]
+
+	def test_ingestion_resumes_within_a_timestamp(self):
+		# older than the other views of the site, so the first page holds two of these
+		insert_views([(BASE_TIME, "/tie", None)] * 5)
+		pages = []
+
+		def interrupt_after_first_page(watermark, limit):
+			if pages:
+				raise frappe.QueryTimeoutError
+			pages.append(_get_web_page_views_after(watermark, limit))
+			return pages[-1]
+
+		with DuckDBConnection() as db:
+			_setup_watermark_table(db)
+			_create_web_page_views_table(db)
+			with patch(
+				"builder.builder_analytics._get_web_page_views_after", side_effect=interrupt_after_first_page
+			):
+				self.assertRaises(frappe.QueryTimeoutError, _ingest_web_page_views, db, page_size=2)
+
+			# the next run resumes in the middle of the views sharing the timestamp
+			_ingest_web_page_views(db, page_size=2)
+			ingested = db.execute("SELECT COUNT(*) FROM web_page_views").fetchone()[0]
+			ties = db.execute("SELECT COUNT(*) FROM web_page_views WHERE path = '/tie'").fetchone()[0]
+
+		self.assertEqual(ingested, frappe.db.count("Web Page View"))
+		self.assertEqual(ties, 5)
+
+	def test_legacy_table_migration(self):
+		insert_views([(BASE_TIME + timedelta(hours=hour), "/legacy", None) for hour in range(3)])
+
+		# views table of a version without derived columns, rollups, watermarks and snapshots
+		legacy_db = duckdb.connect(os.path.join(self.analytics_dir, ANALYTICS_DB_FILE))
+		legacy_db.execute(
+			"CREATE TABLE web_page_views (creation TIMESTAMP, is_unique INTEGER, path VARCHAR, referrer VARCHAR, time_zone VARCHAR, user_agent VARCHAR)"
+		)
+		legacy_views = frappe.get_all(
+			"Web Page View",
+			fields=["creation", "is_unique", "path", "referrer", "time_zone", "user_agent"],
+			as_list=True,
+		)
+		legacy_db.executemany(
+			"INSERT INTO web_page_views VALUES (?, ?, ?, ?, ?, ?)",
+			[(view[0], cint(view[1]), *view[2:]) for view in legacy_views],
+		)
+		legacy_db.close()
+
+		last_view = frappe.get_all("Web Page View", order_by="creation desc", limit=1, pluck="creation")[0]
+		insert_views([(add_to_date(last_view, hours=1), "/legacy", "https://www.example.com/x")])
+		ingest_web_page_views_to_duckdb()
+
+		self.assertTrue(os.path.islink(os.path.join(self.analytics_dir, ANALYTICS_DB_FILE)))
+		self.assertEqual(self.get_ingested_count(), frappe.db.count("Web Page View"))
+		self.assertEqual(self.get_ingested_count("device_class IS NULL OR referrer_domain IS NULL"), 0)
+		with DuckDBCursor() as db:
+			rollup_views = db.execute("SELECT SUM(total_views) FROM web_page_views_daily").fetchone()[0]
+		self.assertEqual(rollup_views, frappe.db.count("Web Page View"))
+
+	def test_rollup_and_raw_analytics_parity(self):
+		referrers = [None, "https://www.google.com/search", "https://example.com/x"]
+		insert_views(
+			[
+				(BASE_TIME + timedelta(hours=hour, minutes=hour % 7), path, referrers[hour % 3])
+				for hour in range(0, 24 * 20, 5)
+				for path in ("/", "/about", None)[: hour % 3 + 1]
+			]
+		)
+		ingest_web_page_views_to_duckdb()
+
+		from_date, to_date = "2001-03-02", "2001-03-15"
+		with DuckDBCursor() as db:
+			source = _get_analytics_source(
+				db, interval="daily", date_range=_get_date_range(from_date, to_date)
+			)
+		self.assertEqual(source["table"], "web_page_views_daily")
+
+		def get_analytics(interval):
+			analytics = get_overall_analytics(interval, from_date=from_date, to_date=to_date)
+			# pages and referrers with equal counts may come in any order
+			for key in ("top_pages", "top_referrers"):
+				analytics[key] = sorted(analytics[key], key=repr)
+			return analytics
+
+		for interval in ("daily", "weekly", "monthly"):
+			rollup_analytics = get_analytics(interval)
+			self.assertTrue(rollup_analytics["total_views"])
+			self.assertIn(None, [page["route"] for page in rollup_analytics["top_pages"]])
+			with patch("builder.builder_analytics._get_rollup_table", return_value="missing_rollup"):
+				self.assertEqual(rollup_analytics, get_analytics(interval))
+
+	def test_ingestion_reuses_previous_snapshot(self):
+		last_view = frappe.get_all("Web Page View", order_by="creation desc", limit=1, pluck="creation")
+		start = last_view[0] if last_view else BASE_TIME
+		with patch("builder.builder_analytics.shutil.copyfile", wraps=shutil.copyfile) as copyfile:
+			for hour in range(4):
+				# newer than the ingested views, like views of a live site
+				insert_views([(add_to_date(start, hours=hour + 1), "/buffered", None)] * 2)
+				ingest_web_page_views_to_duckdb()
+				self.assertEqual(self.get_ingested_count(), frappe.db.count("Web Page View"))
+				self.assertEqual(self.get_ingested_count("path = '/buffered'"), 2 * (hour + 1))
+
+		# only the second ingestion has no previous snapshot to write to
+		self.assertEqual(copyfile.call_count, 1)
+		snapshots = glob.glob(os.path.join(self.analytics_dir, SNAPSHOT_DB_FILE_PATTERN.format("*")))
+		self.assertEqual(len(snapshots), 2)
+		with DuckDBCursor() as db:
+			rollup_views = db.execute(
+				"SELECT SUM(total_views) FROM web_page_views_hourly WHERE path = '/buffered'"
+			).fetchone()[0]
+		self.assertEqual(rollup_views, 8)
@@ -9,13 +9,16 @@ from builder.utils import (
 	ColonRule,
 	camel_case_to_kebab_case,
 	clean_data,
+	compile_restricted_script,
 	copy_asset_file,
 	copy_assets_from_blocks,
 	copy_img_to_asset_folder,
 	escape_single_quotes,
 	execute_script,
+	execute_script_and_combine,
 	extract_components_from_blocks,
 	get_builder_page_preview_file_paths,
+	get_safer_globals,
 	get_template_assets_folder_path,
 	is_component_used,
 	make_safe_get_request,
@@ -123,6 +126,13 @@ class TestBuilderUtils(FrappeTestCase):
 
 		test_page.delete()
 
+		# usages after a block with children must not be skipped
+		blocks = [
+			{"element": "div", "children": [{"element": "span"}]},
+			{"element": "div", "children": [{"element": "div", "extendedFromComponent": "SiblingComponent"}]},
+		]
+		self.assertTrue(is_component_used(blocks, "SiblingComponent"))
+
 	def test_execute_script(self):
 		with self.assertRaises(Exception):
 			execute_script("a + b + c", {"a": 2, "b": 2}, "test.py")
@@ -130,6 +140,59 @@ class TestBuilderUtils(FrappeTestCase):
 		execute_script("data.sum = a + b", {"data": data, "a": 2, "b": 2}, "test.py")
 		self.assertEqual(data.sum, 4)
 
+	def test_compiled_script_cache(self):
+		# with and without server scripts enabled
+		for safe_exec_enabled in (False, True):
+			compile_restricted_script.cache_clear()
+			with patch("builder.utils.is_safe_exec_enabled", return_value=safe_exec_enabled):
+				for i in range(3):
+					data = frappe._dict({})
+					execute_script("data.value = a * 2", {"data": data, "a": i}, "test.py")
+					self.assertEqual(data.value, i * 2)
+
+			self.assertEqual(compile_restricted_script.cache_info().misses, 1)
+			self.assertEqual(compile_restricted_script.cache_info().hits, 2)
+
+	def test_safer_globals(self):
+		first, second = get_safer_globals(), get_safer_globals()
+		self.assertIsNot(first, second)
+		self.assertIsNot(first.frappe, second.frappe)
+		# nested namespaces are built once and shared, so they must not be writable
+		self.assertIs(first.frappe.db, second.frappe.db)
+		with self.assertRaises(TypeError):
+			first.frappe.db.get_all = None
+		with self.assertRaises(TypeError):
+			first.frappe.session["user"] = "Administrator"
+
+		frappe.local.form_dict = frappe._dict(name="test")
+		self.assertEqual(get_safer_globals().frappe.form_dict.name, "test")
+
+	def test_block_data_script_cache(self):
+		# unique script so results from earlier runs aren't in redis
+		script = f"# {frappe.generate_hash()}\nblock.update({{'value': props.value}})"
+		frappe.local.builder_block_data = {}
+
+		with patch("builder.utils.execute_script", wraps=execute_script) as mock_execute:
+			self.assertEqual(execute_script_and_combine(None, script, {"value": 1}), {"value": 1})
+			self.assertEqual(execute_script_and_combine(None, script, {"value": 1}), {"value": 1})
+			self.assertEqual(mock_execute.call_count, 2)
+
+			# once per request for the same props
+			mock_execute.reset_mock()
+			execute_script_and_combine(None, script, {"value": 1}, cache=True)
+			data = execute_script_and_combine({"other": 2}, script, {"value": 1}, cache=True)
+			self.assertEqual(data, {"other": 2, "value": 1})
+			execute_script_and_combine(None, script, {"value": 2}, cache=True)
+			self.assertEqual(mock_execute.call_count, 2)
+
+			# results with a ttl outlive the request
+			mock_execute.reset_mock()
+			execute_script_and_combine(None, script, {"value": 3}, cache_ttl=60)
+			frappe.local.builder_block_data = {}
+			data = execute_script_and_combine(None, script, {"value": 3}, cache_ttl=60)
+			self.assertEqual(data, {"value": 3})
+			self.assertEqual(mock_execute.call_count, 1)
+
 	def test_colon_rule(self):
 		rule = ColonRule("/test/<name>", endpoint="test_endpoint")
 		self.assertEqual(rule.rule, "/test/<name>")
@@ -1,21 +1,76 @@
+import glob
 import os
+import shutil
 import time
+from datetime import datetime, timedelta
 from typing import cast
 
 import duckdb
 import frappe
 import pandas as pd
+from frappe.query_builder.functions import Max
+from frappe.utils.synchronization import filelock
+
+from builder.utils import LRUCache
 
 DUCKDB_TABLE = "web_page_views"
+# symlink to the latest published snapshot, dashboards only read snapshots
+ANALYTICS_DB_FILE = "builder_analytics.duckdb"
+# ingestion wrote here before snapshots were double-buffered, see `DuckDBConnection`
+STAGING_DB_FILE = "builder_analytics.staging.duckdb"
+SNAPSHOT_DB_FILE_PATTERN = "builder_analytics.snapshot-{}.duckdb"
+# held while writing the next snapshot and publishing it, only one process may write a duckdb file
+INGESTION_LOCK = "builder_analytics_ingestion"
+INGESTION_LOCK_TIMEOUT = 20 * 60
+# last ingested view per table, see `_get_watermark`
+WATERMARK_TABLE = "ingestion_watermarks"
+WEB_PAGE_VIEW_FIELDS = ("creation", "is_unique", "path", "referrer", "time_zone", "user_agent")
+INGESTION_PAGE_SIZE = 50000
+# pre-aggregated copies of the views table by bucket, coarsest first, see `_get_analytics_source`
+ROLLUP_BUCKETS = {"daily": "day", "hourly": "hour"}
+# `GROUPING(interval_sort, route, domain)` of each grouping set in `_get_analytics`
+INTERVAL_GROUPING, PAGE_GROUPING, REFERRER_GROUPING = 0b011, 0b101, 0b110
+IS_UNIQUE_SQL = "CAST(CASE WHEN is_unique = '' OR is_unique IS NULL THEN '0' ELSE CAST(is_unique AS VARCHAR) END AS INTEGER)"
+REFERRER_DOMAIN_SQL = """CASE
+	WHEN referrer IS NULL OR referrer = '' THEN 'direct'
+	WHEN REGEXP_MATCHES(referrer, '^https?://([^/]+)') THEN
+		REGEXP_REPLACE(REGEXP_EXTRACT(referrer, '^https?://([^/]+)', 1), '^www\\.', '')
+	ELSE 'direct'
+END"""
+DEVICE_CLASS_SQL = """CASE
+	WHEN user_agent IS NULL OR user_agent = '' THEN 'unknown'
+	WHEN REGEXP_MATCHES(user_agent, '(?i)bot|crawl|spider|slurp|headless') THEN 'bot'
+	WHEN REGEXP_MATCHES(user_agent, '(?i)ipad|tablet|kindle|silk|playbook') THEN 'tablet'
+	WHEN REGEXP_MATCHES(user_agent, '(?i)android') AND NOT REGEXP_MATCHES(user_agent, '(?i)mobile') THEN 'tablet'
+	WHEN REGEXP_MATCHES(user_agent, '(?i)mobi|iphone|ipod|android|phone') THEN 'mobile'
+	ELSE 'desktop'
+END"""
+# columns derived from `Web Page View` fields at ingestion time
+DERIVED_COLUMNS = {"referrer_domain": REFERRER_DOMAIN_SQL, "device_class": DEVICE_CLASS_SQL}
+
+
+# (snapshot path, read-only connection) per site, see `get_analytics_connection`
+analytics_connections = LRUCache(maxsize=16)
+
+
+def _get_analytics_db_path(filename=ANALYTICS_DB_FILE):
+	return os.path.abspath(os.path.join(frappe.get_site_path(), filename))
 
 
 class DuckDBConnection:
+	"""
+	Read-write connection to the next snapshot, only used by ingestion (with the `INGESTION_LOCK` held).
+
+	Snapshots are double-buffered: the snapshot published before the current one is brought up to date
+	with the current one and written to, then `publish_analytics_snapshot` points readers to it.
+	"""
+
 	def __init__(self):
 		self.db = None
+		self.snapshot_path = None
 
 	def __enter__(self):
-		duckdb_path = os.path.join(frappe.get_site_path(), "builder_analytics.duckdb")
-		self.db = duckdb.connect(duckdb_path)
+		self.snapshot_path, self.db = _open_next_snapshot()
 		return self.db
 
 	def __exit__(self, exc_type, exc_val, exc_tb):
@@ -23,9 +78,161 @@ class DuckDBConnection:
 			self.db.close()
 
 
-def _get_date_filter(from_date: str | None = None, to_date: str | None = None):
+def _get_new_snapshot_path():
+	return _get_analytics_db_path(SNAPSHOT_DB_FILE_PATTERN.format(time.time_ns()))
+
+
+def _open_next_snapshot():
+	published_path = _get_analytics_db_path()
+	if os.path.exists(published_path) and not os.path.islink(published_path):
+		# views ingested before snapshots existed, merge its WAL into the file before copying it
+		legacy_db = duckdb.connect(published_path)
+		legacy_db.execute("CHECKPOINT")
+		legacy_db.close()
+		snapshot_path = _get_new_snapshot_path()
+		shutil.copyfile(published_path, snapshot_path)
+		return snapshot_path, duckdb.connect(snapshot_path)
+
+	current_snapshot = os.path.realpath(published_path) if os.path.islink(published_path) else None
+	buffers = [
+		path
+		for path in (
+			*glob.glob(_get_analytics_db_path(SNAPSHOT_DB_FILE_PATTERN.format("*"))),
+			_get_analytics_db_path(STAGING_DB_FILE),
+		)
+		if os.path.exists(path) and path != current_snapshot
+	]
+	if buffers:
+		snapshot_path = max(buffers, key=os.path.getmtime)
+		try:
+			db = duckdb.connect(snapshot_path)
+		except duckdb.Error:
+			# a reader still holds the previous snapshot open
+			db = None
+		if db and (not current_snapshot or _catch_up_with_snapshot(db, current_snapshot)):
+			return snapshot_path, db
+		if db:
+			db.close()
+
+	snapshot_path = _get_new_snapshot_path()
+	if current_snapshot:
+		shutil.copyfile(current_snapshot, snapshot_path)
+	return snapshot_path, duckdb.connect(snapshot_path)
+
+
+def _get_tables(db, catalog: str):
+	return db.execute(
+		"SELECT table_name, column_name, data_type FROM information_schema.columns WHERE table_catalog = ? ORDER BY ALL",
+		[catalog],
+	).fetchall()
+
+
+def _catch_up_with_snapshot(db, snapshot_path: str) -> bool:
+	"""
+	Replace views and rollup buckets from the earliest watermark of both snapshots on with those of the
+	published snapshot. Return False if the tables differ, i.e. the published snapshot was migrated.
+	"""
+	db.execute(f"ATTACH '{snapshot_path}' AS published (READ_ONLY)")
+	try:
+		catalog = db.execute("SELECT current_database()").fetchone()[0]
+		if _get_tables(db, catalog) != _get_tables(db, "published") or not _table_exists(db, WATERMARK_TABLE):
+			return False
+		watermarks = db.execute(
+			f"""SELECT table_name, watermark.creation, published_watermark.creation
+			FROM {WATERMARK_TABLE} watermark
+			FULL JOIN published.{WATERMARK_TABLE} published_watermark USING (table_name)"""
+		).fetchall()
+		if any(None in watermark for watermark in watermarks):
+			# views of a table ingested by one snapshot only, their rows can't be matched
+			return False
+
+		db.begin()
+		for table_name, *creations in watermarks:
+			since = min(creations)
+			db.execute(f"DELETE FROM {table_name} WHERE creation >= ?", [since])
+			db.execute(
+				f"INSERT INTO {table_name} BY NAME SELECT * FROM published.{table_name} WHERE creation >= ?",
+				[since],
+			)
+			for interval, bucket in ROLLUP_BUCKETS.items():
+				rollup_table = _get_rollup_table(table_name, interval)
+				bucket_filter = f"bucket >= date_trunc('{bucket}', ?::TIMESTAMP)"
+				db.execute(f"DELETE FROM {rollup_table} WHERE {bucket_filter}", [since])
+				db.execute(
+					f"INSERT INTO {rollup_table} BY NAME SELECT * FROM published.{rollup_table} WHERE {bucket_filter}",
+					[since],
+				)
+		db.execute(f"DELETE FROM {WATERMARK_TABLE}")
+		db.execute(f"INSERT INTO {WATERMARK_TABLE} BY NAME SELECT * FROM published.{WATERMARK_TABLE}")
+		db.commit()
+		return True
+	finally:
+		db.execute("DETACH published")
+
+
+class DuckDBCursor:
+	"""Cursor on the long-lived read-only connection to the published snapshot, one per call"""
+
+	def __init__(self):
+		self.cursor = None
+
+	def __enter__(self):
+		self.cursor = get_analytics_connection().cursor()
+		return self.cursor
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		if self.cursor:
+			self.cursor.close()
+
+
+def get_analytics_connection():
+	"""
+	Get the process-wide read-only connection to the published snapshot of the current site.
+
+	Snapshots are never modified after publishing, a new connection is opened once ingestion
+	publishes a new one. Each snapshot has its own path since duckdb shares database instances by path.
+	"""
+	snapshot_path = os.path.realpath(_get_analytics_db_path())
+	cached = analytics_connections.get("snapshot")
+	if cached and cached[0] == snapshot_path:
+		return cached[1]
+
+	# the previous connection is closed once in-flight cursors are done with it
+	connection = duckdb.connect(snapshot_path, read_only=True)
+	analytics_connections.set("snapshot", (snapshot_path, connection))
+	return connection
+
+
+def publish_analytics_snapshot(snapshot_path: str):
+	"""
+	Point readers to the (checkpointed and closed) next snapshot written by `DuckDBConnection`.
+
+	Must be called with the `INGESTION_LOCK` held. The snapshot is renamed first, so it gets a path no
+	reader has opened. The previously published snapshot is kept as the buffer for the next ingestion.
+	"""
+	published_path = _get_analytics_db_path()
+	previous_snapshot = os.path.realpath(published_path) if os.path.islink(published_path) else None
+
+	new_snapshot = _get_new_snapshot_path()
+	os.replace(snapshot_path, new_snapshot)
+
+	# swap the symlink atomically, readers see either the previous or the new snapshot
+	temp_link = f"{published_path}.{os.getpid()}.tmp"
+	os.symlink(os.path.basename(new_snapshot), temp_link)
+	os.replace(temp_link, published_path)
+
+	keep = {new_snapshot, previous_snapshot}
+	for path in (
+		*glob.glob(_get_analytics_db_path(SNAPSHOT_DB_FILE_PATTERN.format("*"))),
+		_get_analytics_db_path(STAGING_DB_FILE),
+	):
+		if path not in keep and os.path.exists(path):
+			os.remove(path)
+
+
+def _get_date_range(from_date: str | None = None, to_date: str | None = None) -> tuple[str, str] | None:
 	if not from_date or not to_date:
-		return ""
+		return None
 
 	# Add time component if not present
 	if len(from_date) == 10:  # YYYY-MM-DD format
@@ -33,7 +240,13 @@ def _get_date_filter(from_date: str | None = None, to_date: str | None = None):
 	if len(to_date) == 10:  # YYYY-MM-DD format
 		to_date += " 23:59:59"
 
-	return f"creation >= '{from_date}' AND creation <= '{to_date}'"
+	return from_date, to_date
+
+
+def _get_date_filter(date_range: tuple[str, str] | None, column: str = "creation") -> str:
+	if not date_range:
+		return ""
+	return f"{column} >= '{date_range[0]}' AND {column} <= '{date_range[1]}'"
 
 
 def _get_empty_analytics():
@@ -51,76 +264,260 @@ def _get_route_filter(route: str | None = None, route_filter_type: str = "wildca
 		return f"path LIKE '%{route}%'"
 
 
-def setup_duckdb_table(table_name=DUCKDB_TABLE):
-	with DuckDBConnection() as db:
-		sql_connection = frappe.db.get_connection()
-		df = pd.read_sql(
-			"SELECT creation, is_unique, path, referrer, time_zone, user_agent FROM `tabWeb Page View`",
-			sql_connection,  # type: ignore
-		)
-		db.register("df", df)
+def _get_where_clause(
+	source: dict,
+	date_range: tuple[str, str] | None = None,
+	route: str | None = None,
+	route_filter_type: str = "wildcard",
+) -> str:
+	where_conditions = []
+	if date_filter := _get_date_filter(date_range, source["time"]):
+		where_conditions.append(date_filter)
+	if route_filter := _get_route_filter(route, route_filter_type):
+		where_conditions.append(route_filter)
+
+	return " AND ".join(where_conditions) if where_conditions else "1=1"
+
+
+def _table_exists(db, table_name: str) -> bool:
+	result = db.execute(
+		"SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?", [table_name]
+	).fetchone()
+	return bool(result and result[0])
+
+
+def _get_rollup_table(table_name: str, interval: str) -> str:
+	return f"{table_name}_{interval}"
+
+
+def _covers_whole_buckets(date_range: tuple[str, str] | None, bucket: str) -> bool:
+	"""Check if the date range starts and ends on bucket boundaries (ranges end at :59:59)"""
+	if not date_range:
+		return True
+	try:
+		start = datetime.fromisoformat(date_range[0])
+		end = datetime.fromisoformat(date_range[1]) + timedelta(seconds=1)
+	except ValueError:
+		return False
+
+	truncate = {"minute": 0, "second": 0, "microsecond": 0}
+	if bucket == "day":
+		truncate["hour"] = 0
+	return start == start.replace(**truncate) and end == end.replace(**truncate)
+
+
+def _get_analytics_source(
+	db, table_name=DUCKDB_TABLE, interval: str | None = None, date_range: tuple[str, str] | None = None
+) -> dict:
+	"""
+	Get the coarsest table able to answer a query along with the expressions to aggregate it.
+
+	Rollups only hold whole buckets, so they are used when the requested interval is not finer than
+	their bucket and the date range starts and ends on bucket boundaries.
+	"""
+	for rollup_interval, bucket in ROLLUP_BUCKETS.items():
+		if interval == "hourly" and bucket != "hour":
+			continue
+		rollup_table = _get_rollup_table(table_name, rollup_interval)
+		if _covers_whole_buckets(date_range, bucket) and _table_exists(db, rollup_table):
+			return {
+				"table": rollup_table,
+				"time": "bucket",
+				"total": "SUM(total_views)",
+				"unique": "SUM(unique_views)",
+				"domain": "referrer_domain",
+				# rollups store views without a path under '' since it is part of their primary key
+				"path": "NULLIF(path, '')",
+			}
+
+	return {
+		"table": table_name,
+		"time": "creation",
+		"total": "COUNT(*)",
+		"unique": "SUM(is_unique)",
+		"domain": "referrer_domain",
+		"path": "path",
+	}
+
+
+def _create_web_page_views_table(db, table_name=DUCKDB_TABLE):
+	db.execute(
+		f"CREATE OR REPLACE TABLE {table_name} (creation TIMESTAMP, is_unique INTEGER, path VARCHAR, referrer VARCHAR, time_zone VARCHAR, user_agent VARCHAR, referrer_domain VARCHAR, device_class VARCHAR)"
+	)
+	db.execute(f"DELETE FROM {WATERMARK_TABLE} WHERE table_name = ?", [table_name])
+	_create_rollup_tables(db, table_name)
+
+
+def _add_derived_columns(db, table_name=DUCKDB_TABLE):
+	"""Add and fill derived columns missing from a views table created by an older version"""
+	columns = {
+		row[0]
+		for row in db.execute(
+			"SELECT column_name FROM information_schema.columns WHERE table_name = ?", [table_name]
+		).fetchall()
+	}
+	missing_columns = {column: sql for column, sql in DERIVED_COLUMNS.items() if column not in columns}
+	if not missing_columns:
+		return
+
+	db.begin()
+	for column in missing_columns:
+		db.execute(f"ALTER TABLE {table_name} ADD COLUMN {column} VARCHAR")
+	assignments = ", ".join(f"{column} = {sql}" for column, sql in missing_columns.items())
+	db.execute(f"UPDATE {table_name} SET {assignments}")
+	db.commit()
+
+
+def _create_rollup_tables(db, table_name=DUCKDB_TABLE):
+	for interval in ROLLUP_BUCKETS:
 		db.execute(
-			f"CREATE OR REPLACE TABLE {table_name} AS SELECT creation, CAST(CASE WHEN is_unique = '' OR is_unique IS NULL THEN '0' ELSE CAST(is_unique AS VARCHAR) END AS INTEGER) as is_unique, path, referrer, time_zone, user_agent FROM df"
+			f"""CREATE OR REPLACE TABLE {_get_rollup_table(table_name, interval)} (
+				bucket TIMESTAMP,
+				path VARCHAR,
+				referrer_domain VARCHAR,
+				total_views BIGINT,
+				unique_views BIGINT,
+				PRIMARY KEY (bucket, path, referrer_domain)
+			)"""
 		)
-		print(f"Successfully ingested {len(df)} records into DuckDB")
 
 
-def ingest_web_page_views_to_duckdb(table_name=DUCKDB_TABLE):
-	with DuckDBConnection() as db:
-		table_exists = db.execute(
-			f"SELECT COUNT(*) FROM information_schema.tables WHERE table_name = '{table_name}'"
-		).fetchone()
-		if table_exists and table_exists[0] == 0:
-			setup_duckdb_table(table_name)
-			return
+def _update_rollups(db, views: str, table_name=DUCKDB_TABLE):
+	"""Add views (a table or subquery with the columns of the views table) to the rollups"""
+	for interval, bucket in ROLLUP_BUCKETS.items():
+		db.execute(
+			f"""INSERT INTO {_get_rollup_table(table_name, interval)}
+			SELECT
+				date_trunc('{bucket}', creation) as bucket,
+				COALESCE(path, '') as path,
+				referrer_domain,
+				COUNT(*) as total_views,
+				SUM(is_unique) as unique_views
+			FROM {views}
+			GROUP BY ALL
+			ON CONFLICT DO UPDATE SET
+				total_views = total_views + EXCLUDED.total_views,
+				unique_views = unique_views + EXCLUDED.unique_views"""
+		)
 
-		result = db.execute(f"SELECT MAX(creation) FROM {table_name}").fetchone()
-		last_record = result[0] if result and result[0] else None
 
-		filters = {"creation": [">", last_record]} if last_record else {}
+def _setup_watermark_table(db):
+	"""(creation, name) of the last ingested `Web Page View` per DuckDB table"""
+	db.execute(
+		f"CREATE TABLE IF NOT EXISTS {WATERMARK_TABLE} (table_name VARCHAR PRIMARY KEY, creation TIMESTAMP, name VARCHAR)"
+	)
+
 
-		total_count = frappe.db.count("Web Page View", filters=filters)
-		print(f"Starting ingestion of {total_count} records...")
+def _get_watermark(db, table_name=DUCKDB_TABLE):
+	watermark = db.execute(
+		f"SELECT creation, name FROM {WATERMARK_TABLE} WHERE table_name = ?", [table_name]
+	).fetchone()
+	if watermark:
+		return watermark
+
+	# table ingested before watermarks existed, all views up to the latest timestamp are in it
+	result = db.execute(f"SELECT MAX(creation) FROM {table_name}").fetchone()
+	if not result or not result[0]:
+		return None
+	WebPageView = frappe.qb.DocType("Web Page View")
+	name = (
+		frappe.qb.from_(WebPageView)
+		.select(Max(WebPageView.name))
+		.where(WebPageView.creation == result[0])
+		.run()[0][0]
+	)
+	return result[0], name or ""
+
+
+def _get_web_page_views_after(watermark, limit=INGESTION_PAGE_SIZE):
+	"""Next page of views ordered by (creation, name), views sharing a timestamp are never skipped"""
+	WebPageView = frappe.qb.DocType("Web Page View")
+	query = (
+		frappe.qb.from_(WebPageView)
+		.select(*(WebPageView[field] for field in WEB_PAGE_VIEW_FIELDS), WebPageView.name)
+		.orderby(WebPageView.creation)
+		.orderby(WebPageView.name)
+		.limit(limit)
+	)
+	if watermark:
+		creation, name = watermark
+		query = query.where(
+			(WebPageView.creation > creation)
+			| ((WebPageView.creation == creation) & (WebPageView.name > name))
+		)
+	return query.run()
 
-		page_size = 20000
-		start = 0
-		processed = 0
 
-		db.begin()
+def setup_duckdb_table(table_name=DUCKDB_TABLE):
+	with filelock(INGESTION_LOCK, timeout=INGESTION_LOCK_TIMEOUT):
+		analytics_db = DuckDBConnection()
+		with analytics_db as db:
+			_setup_watermark_table(db)
+			_create_web_page_views_table(db, table_name)
+			processed = _ingest_web_page_views(db, table_name)
+			db.execute("CHECKPOINT")
 
-		while True:
-			result = db.execute(f"SELECT MAX(creation) FROM {table_name}").fetchone()
-			last_record = result[0] if result and result[0] else None
-
-			filters = {"creation": [">", last_record]} if last_record else {}
-			records = frappe.get_all(
-				"Web Page View",
-				filters=filters,
-				fields=["creation", "is_unique", "path", "referrer", "time_zone", "user_agent"],
-				as_list=True,
-				limit=page_size,
-				order_by="creation asc",
-			)
+		publish_analytics_snapshot(analytics_db.snapshot_path)
+	print(f"Successfully ingested {processed} records into DuckDB")
 
-			if not records:
-				break
 
-			db.executemany(
-				f"INSERT INTO {table_name} (creation, is_unique, path, referrer, time_zone, user_agent) VALUES (?, CAST(? AS INTEGER), ?, ?, ?, ?)",
-				records,
-			)
+def ingest_web_page_views_to_duckdb(table_name=DUCKDB_TABLE):
+	with filelock(INGESTION_LOCK, timeout=INGESTION_LOCK_TIMEOUT):
+		analytics_db = DuckDBConnection()
+		with analytics_db as db:
+			_setup_watermark_table(db)
+			if not _table_exists(db, table_name):
+				_create_web_page_views_table(db, table_name)
+			else:
+				_add_derived_columns(db, table_name)
+				if not all(_table_exists(db, _get_rollup_table(table_name, i)) for i in ROLLUP_BUCKETS):
+					# views ingested before rollups existed
+					db.begin()
+					_create_rollup_tables(db, table_name)
+					_update_rollups(db, table_name, table_name)
+					db.commit()
+
+			processed = _ingest_web_page_views(db, table_name)
+			db.execute("CHECKPOINT")
+
+		if processed or not os.path.islink(_get_analytics_db_path()):
+			publish_analytics_snapshot(analytics_db.snapshot_path)
+	print(f"Successfully ingested {processed} records into DuckDB")
+
+
+def _ingest_web_page_views(db, table_name=DUCKDB_TABLE, page_size=INGESTION_PAGE_SIZE):
+	"""Append views newer than the watermark, one transaction per page so an interrupted run resumes"""
+	watermark = _get_watermark(db, table_name)
+	processed = 0
+
+	while True:
+		records = _get_web_page_views_after(watermark, page_size)
+		if not records:
+			break
+
+		batch = pd.DataFrame.from_records(records, columns=[*WEB_PAGE_VIEW_FIELDS, "name"])
+		watermark = (records[-1][0], records[-1][-1])
 
-			processed += len(records)
-			progress = (processed / total_count) * 100 if total_count > 0 else 100
-			print(f"Progress: {processed}/{total_count} ({progress:.1f}%) records ingested")
+		db.begin()
+		db.register("web_page_views_batch", batch)
+		# derive columns once, both the views table and the rollups are filled from this
+		derived_columns = ", ".join(f"{sql} as {column}" for column, sql in DERIVED_COLUMNS.items())
+		db.execute(
+			f"CREATE OR REPLACE TEMP TABLE web_page_views_batch_rows AS SELECT creation, {IS_UNIQUE_SQL} as is_unique, path, referrer, time_zone, user_agent, {derived_columns} FROM web_page_views_batch"
+		)
+		db.execute(f"INSERT INTO {table_name} BY NAME SELECT * FROM web_page_views_batch_rows")
+		_update_rollups(db, "web_page_views_batch_rows", table_name)
+		db.execute(f"INSERT OR REPLACE INTO {WATERMARK_TABLE} VALUES (?, ?, ?)", [table_name, *watermark])
+		db.commit()
+		db.unregister("web_page_views_batch")
 
-			if len(records) < page_size:
-				break
+		processed += len(records)
+		print(f"Progress: {processed} records ingested")
 
-			start += page_size
+		if len(records) < page_size:
+			break
 
-		db.commit()
-		print(f"Successfully ingested {processed} records into DuckDB")
+	return processed
 
 
 def _get_interval_formats(interval):
@@ -142,46 +539,68 @@ def _get_interval_formats(interval):
 	return display_formats[interval], sort_formats.get(interval, display_formats[interval])
 
 
-def _get_aggregated_views_query(where_clause, table_name=DUCKDB_TABLE):
-	"""Get query for total and unique view counts"""
-	return f"SELECT COUNT(*) as total_views, SUM(is_unique) as unique_views FROM {table_name} WHERE {where_clause}"
-
+def _get_analytics(db, where_clause, interval, source, limit=20):
+	"""
+	Get the interval series, totals, top pages and top referrers in a single pass over the filtered views.
 
-def _get_interval_views_query(where_clause, interval, table_name=DUCKDB_TABLE):
-	"""Get query for views grouped by time interval"""
+	Every breakdown is a grouping set of one aggregation, rows are told apart by their grouping id.
+	"""
 	display_fmt, sort_fmt = _get_interval_formats(interval)
-	return f"""
+	rows = db.execute(
+		f"""
+		WITH filtered_views AS (
+			SELECT
+				*,
+				strftime('{display_fmt}', {source["time"]}) as interval_label,
+				strftime('{sort_fmt}', {source["time"]}) as interval_sort,
+				{source["domain"]} as domain,
+				{source["path"]} as route
+			FROM {source["table"]}
+			WHERE {where_clause}
+		)
 		SELECT
-			strftime('{display_fmt}', creation) as interval,
-			COUNT(*) as total_page_views,
-			SUM(is_unique) as unique_page_views
-		FROM {table_name}
-		WHERE {where_clause}
-		GROUP BY interval, strftime('{sort_fmt}', creation)
-		ORDER BY strftime('{sort_fmt}', creation)
+			GROUPING(interval_sort, route, domain) as grouping_id,
+			interval_label,
+			interval_sort,
+			route,
+			domain,
+			{source["total"]} as total_views,
+			{source["unique"]} as unique_views
+		FROM filtered_views
+		GROUP BY GROUPING SETS ((interval_label, interval_sort), (route), (domain), ())
 	"""
+	).fetchall()
+
+	analytics = {"total_unique_views": 0, "total_views": 0, "data": [], "top_pages": [], "top_referrers": []}
+	series, pages, referrers = [], [], []
+	for grouping_id, interval_label, interval_sort, route, domain, total_views, unique_views in rows:
+		total_views, unique_views = total_views or 0, unique_views or 0
+		if grouping_id == INTERVAL_GROUPING:
+			series.append((interval_sort, interval_label, total_views, unique_views))
+		elif grouping_id == PAGE_GROUPING:
+			pages.append({"route": route, "view_count": total_views, "unique_view_count": unique_views})
+		elif grouping_id == REFERRER_GROUPING:
+			referrers.append({"domain": domain, "count": total_views, "unique_count": unique_views})
+		else:
+			analytics["total_views"], analytics["total_unique_views"] = total_views, unique_views
+
+	analytics["data"] = [
+		{"interval": r[1], "total_page_views": r[2], "unique_page_views": r[3]} for r in sorted(series)
+	]
+	analytics["top_pages"] = sorted(pages, key=lambda r: r["view_count"], reverse=True)[:limit]
+	analytics["top_referrers"] = sorted(referrers, key=lambda r: r["count"], reverse=True)[:limit]
+	return analytics
 
 
-def _get_referrer_domain_query(where_clause, limit=10, table_name=DUCKDB_TABLE):
+def _get_referrer_domain_query(where_clause, source, limit=10):
 	"""Get query for top referrer domains with counts"""
 	return f"""
-		WITH parsed_referrers AS (
-			SELECT
-				CASE
-					WHEN referrer IS NULL OR referrer = '' THEN 'direct'
-					WHEN REGEXP_MATCHES(referrer, '^https?://([^/]+)') THEN
-						REGEXP_REPLACE(REGEXP_EXTRACT(referrer, '^https?://([^/]+)', 1), '^www\\.', '')
-					ELSE 'direct'
-				END as domain,
-				is_unique
-			FROM {table_name}
-			WHERE {where_clause}
-		)
 		SELECT
-			domain,
-			COUNT(*) as total_count,
-			SUM(is_unique) as unique_count
-		FROM parsed_referrers
+			{source["domain"]} as domain,
+			{source["total"]} as total_count,
+			{source["unique"]} as unique_count
+		FROM {source["table"]}
+		WHERE {where_clause}
 		GROUP BY domain
 		ORDER BY total_count DESC
 		LIMIT {limit}
@@ -198,44 +617,26 @@ def get_page_analytics(
 ):
 	"""Get analytics data for a specific page route or all pages"""
 	try:
-		# Get date filter
-		date_filter = _get_date_filter(from_date, to_date)
-		if not date_filter:
+		# Get date range
+		date_range = _get_date_range(from_date, to_date)
+		if not date_range:
 			return _get_empty_analytics()
 
-		# Add route filter
-		route_filter = _get_route_filter(route, route_filter_type)
-
-		# Build WHERE clause properly
-		where_conditions = []
-		if date_filter:
-			where_conditions.append(date_filter)
-		if route_filter:
-			where_conditions.append(route_filter)
-
-		where_clause = " AND ".join(where_conditions) if where_conditions else "1=1"
-
 		# Use provided interval or default to daily
 		interval = interval or "daily"
 
-		with DuckDBConnection() as db:
-			# Get interval-based data
-			interval_query = _get_interval_views_query(where_clause, interval, table_name)
-			rows = db.execute(interval_query).fetchall()
-
-			# Get total views
-			total_query = _get_aggregated_views_query(where_clause, table_name)
-			total_views, total_unique_views = db.execute(total_query).fetchone() or (0, 0)
-
-			# Get top referrers for this specific page/route
-			referrer_query = _get_referrer_domain_query(where_clause, 10, table_name)
-			referrer_rows = db.execute(referrer_query).fetchall()
+		with DuckDBCursor() as db:
+			source = _get_analytics_source(db, table_name, interval, date_range)
+			where_clause = _get_where_clause(source, date_range, route, route_filter_type)
+			analytics = _get_analytics(db, where_clause, interval, source)
 
 		return {
-			"total_unique_views": total_unique_views or 0,
-			"total_views": total_views or 0,
-			"data": [{"interval": r[0], "total_page_views": r[1], "unique_page_views": r[2]} for r in rows],
-			"top_referrers": [{"domain": r[0], "count": r[1]} for r in referrer_rows],
+			"total_unique_views": analytics["total_unique_views"],
+			"total_views": analytics["total_views"],
+			"data": analytics["data"],
+			"top_referrers": [
+				{"domain": r["domain"], "count": r["count"]} for r in analytics["top_referrers"][:10]
+			],
 		}
 	except Exception as e:
 		frappe.log_error("DuckDB Analytics Error", str(e))
@@ -249,25 +650,16 @@ def get_top_pages(
 	to_date: str | None = None,
 	route_filter_type: str = "wildcard",
 ):
-	# Get date filter
-	date_filter = _get_date_filter(from_date, to_date)
-	route_filter = _get_route_filter(route, route_filter_type)
-
-	# Build WHERE clause properly
-	where_conditions = []
-	if date_filter:
-		where_conditions.append(date_filter)
-	if route_filter:
-		where_conditions.append(route_filter)
-
-	where_clause = "WHERE " + " AND ".join(where_conditions) if where_conditions else ""
+	date_range = _get_date_range(from_date, to_date)
 
-	with DuckDBConnection() as db:
+	with DuckDBCursor() as db:
+		source = _get_analytics_source(db, table_name, date_range=date_range)
+		where_clause = _get_where_clause(source, date_range, route, route_filter_type)
 		q = f"""
-			SELECT path as route, COUNT(*) as view_count, SUM(is_unique) as unique_view_count
-			FROM {table_name}
-			{where_clause}
-			GROUP BY path
+			SELECT {source["path"]} as route, {source["total"]} as view_count, {source["unique"]} as unique_view_count
+			FROM {source["table"]}
+			WHERE {where_clause}
+			GROUP BY route
 			ORDER BY view_count DESC
 			LIMIT 20
 		"""
@@ -284,21 +676,12 @@ def get_top_referrers(
 ):
 	"""Get top referrers from analytics data using SQL for domain extraction"""
 	try:
-		# Get date filter
-		date_filter = _get_date_filter(from_date, to_date)
-		route_filter = _get_route_filter(route, route_filter_type)
-
-		# Build WHERE clause properly
-		where_conditions = []
-		if date_filter:
-			where_conditions.append(date_filter)
-		if route_filter:
-			where_conditions.append(route_filter)
+		date_range = _get_date_range(from_date, to_date)
 
-		where_clause = " AND ".join(where_conditions) if where_conditions else "1=1"
-
-		with DuckDBConnection() as db:
-			referrer_query = _get_referrer_domain_query(where_clause, 20, table_name)
+		with DuckDBCursor() as db:
+			source = _get_analytics_source(db, table_name, date_range=date_range)
+			where_clause = _get_where_clause(source, date_range, route, route_filter_type)
+			referrer_query = _get_referrer_domain_query(where_clause, source, 20)
 			rows = db.execute(referrer_query).fetchall()
 			return [{"domain": r[0], "count": r[1], "unique_count": r[2]} for r in rows]
 	except Exception as e:
@@ -315,28 +698,20 @@ def get_overall_analytics(
 	route_filter_type: str = "wildcard",
 ):
 	"""Get overall site analytics with top pages and referrers"""
-	analytics = get_page_analytics(
-		route=route,
-		interval=interval,
-		table_name=table_name,
-		from_date=from_date,
-		to_date=to_date,
-		route_filter_type=route_filter_type,
-	)
-	analytics["top_pages"] = get_top_pages(
-		table_name=table_name,
-		route=route,
-		from_date=from_date,
-		to_date=to_date,
-		route_filter_type=route_filter_type,
-	)
-	analytics["top_referrers"] = get_top_referrers(
-		table_name=table_name,
-		route=route,
-		from_date=from_date,
-		to_date=to_date,
-		route_filter_type=route_filter_type,
-	)
+	date_range = _get_date_range(from_date, to_date)
+	interval = interval or "daily"
+	try:
+		with DuckDBCursor() as db:
+			source = _get_analytics_source(db, table_name, interval, date_range)
+			where_clause = _get_where_clause(source, date_range, route, route_filter_type)
+			analytics = _get_analytics(db, where_clause, interval, source)
+	except Exception as e:
+		frappe.log_error("DuckDB Analytics Error", str(e))
+		return {**_get_empty_analytics(), "top_pages": []}
+
+	if not date_range:
+		# views over time are only reported for a date range, top pages and referrers cover all time
+		analytics.update(total_unique_views=0, total_views=0, data=[])
 	return analytics
 
 
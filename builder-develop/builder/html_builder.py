@@ -0,0 +1,163 @@
+"""
+Lightweight replacement for the subset of the BeautifulSoup API used by the block renderer.
+
+Tags are plain python objects that are serialized straight into a list of strings. The output
+matches `str()` of the equivalent `bs4` tree (``html.parser`` builder, ``minimal`` formatter).
+"""
+
+from functools import lru_cache
+
+import bs4 as bs
+from bs4.builder import HTMLTreeBuilder
+
+VOID_ELEMENTS = frozenset(HTMLTreeBuilder.DEFAULT_EMPTY_ELEMENT_TAGS)
+# contents of these tags are not entity-escaped by bs4
+CDATA_CONTAINING_TAGS = frozenset(("script", "style"))
+ASCII_SPACES = " \n\t\f\r"
+
+
+def escape_html_text(text: str) -> str:
+	return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def quote_attribute_value(value: str) -> str:
+	value = escape_html_text(value)
+	if '"' not in value:
+		return f'"{value}"'
+	if "'" not in value:
+		return f"'{value}'"
+	return '"{}"'.format(value.replace('"', "&quot;"))
+
+
+class HTMLSoup:
+	"""Tag factory, stands in for `bs.BeautifulSoup` in the renderer state"""
+
+	def new_tag(self, name: str) -> "HTMLTag":
+		return HTMLTag(name)
+
+
+class HTMLTag:
+	__slots__ = ("attrs", "contents", "name")
+
+	def __init__(self, name: str, attrs: dict | None = None):
+		self.name = name
+		self.attrs = attrs if attrs is not None else {}
+		self.contents = []
+
+	def __setitem__(self, key, value):
+		self.attrs[key] = value
+
+	def __getitem__(self, key):
+		return self.attrs[key]
+
+	@property
+	def string(self):
+		return "".join(c for c in self.contents if isinstance(c, str))
+
+	@string.setter
+	def string(self, value: str):
+		self.contents = [value]
+
+	def append(self, child: "str | HTMLTag | HTMLFragment"):
+		self.contents.append(child)
+
+	def insert(self, index: int, child: "str | HTMLTag | HTMLFragment"):
+		self.contents.insert(index, child)
+
+	def render(self, buffer: list[str]):
+		buffer.append(self.get_start_tag())
+		if not self.contents and self.name in VOID_ELEMENTS:
+			return
+
+		escape_text = self.name not in CDATA_CONTAINING_TAGS
+		for child in self.contents:
+			if isinstance(child, str):
+				buffer.append(escape_html_text(child) if escape_text else child)
+			elif isinstance(child, HTMLFragment):
+				child.render(buffer, escape_text)
+			else:
+				child.render(buffer)
+
+		buffer.append(f"</{self.name}>")
+
+	def get_start_tag(self) -> str:
+		parts = [self.name]
+		for key, value in sorted(self.attrs.items()):
+			if value is None:
+				parts.append(str(key))
+				continue
+			if isinstance(value, list | tuple):
+				value = " ".join(value)
+			elif not isinstance(value, str):
+				value = str(value)
+			parts.append(f"{key}={quote_attribute_value(value)}")
+
+		if not self.contents and self.name in VOID_ELEMENTS:
+			return f"<{' '.join(parts)}/>"
+		return f"<{' '.join(parts)}>"
+
+	def __str__(self):
+		buffer = []
+		self.render(buffer)
+		return "".join(buffer)
+
+
+class HTMLFragment:
+	"""
+	Parsed `innerHTML` of a block.
+
+	Top level text nodes are kept raw since their escaping depends on the tag they end up in,
+	everything else is stored serialized.
+	"""
+
+	__slots__ = ("fonts", "nodes")
+
+	def __init__(self, nodes: tuple[tuple[bool, str], ...], fonts: tuple[str, ...] = ()):
+		self.nodes = nodes
+		self.fonts = fonts
+
+	def render(self, buffer: list[str], escape_text: bool = True):
+		for is_text, value in self.nodes:
+			buffer.append(escape_html_text(value) if is_text and escape_text else value)
+
+
+class RawHTML(bs.element.PreformattedString):
+	"""Serialized markup, inserted into a `bs4` tree as is"""
+
+	PREFIX = ""
+	SUFFIX = ""
+
+
+@lru_cache(maxsize=2048)
+def get_html_fragment(html: str) -> HTMLFragment:
+	"""Parse (and memoize) an HTML snippet the same way `bs.BeautifulSoup(html, "html.parser")` would."""
+	if "<" not in html and "&" not in html:
+		# plain text, bs4 only collapses whitespace-only strings
+		if not html.strip(ASCII_SPACES):
+			html = "\n" if "\n" in html else " "
+		return HTMLFragment(((True, html),))
+
+	soup = bs.BeautifulSoup(html, "html.parser")
+	nodes = []
+	for node in soup.contents:
+		if isinstance(node, bs.element.PreformattedString):
+			nodes.append((False, node.output_ready("minimal")))
+		elif isinstance(node, bs.NavigableString):
+			nodes.append((True, str(node)))
+		else:
+			nodes.append((False, node.decode()))
+
+	return HTMLFragment(tuple(nodes), tuple(get_fonts_from_html(soup)))
+
+
+def get_fonts_from_html(soup: bs.BeautifulSoup) -> list[str]:
+	"""Get font-family names used in inline styles, in document order"""
+	fonts = []
+	for tag in soup.find_all(style=True):
+		styles = tag.attrs.get("style").split(";")
+		for style in styles:
+			if "font-family" in style:
+				font = style.split(":")[1].strip()
+				if font:
+					fonts.append(font)
+	return fonts
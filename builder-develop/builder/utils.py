@@ -1,15 +1,21 @@
+import hashlib
 import inspect
 import os
 import re
 import shutil
 import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from functools import lru_cache
 from os.path import join
 from urllib.parse import unquote, urlparse
 
 import frappe
 from frappe.modules.import_file import import_file_by_path
-from frappe.utils import get_url
+from frappe.utils import cint, get_url
 from frappe.utils.html_utils import unescape_html
 from frappe.utils.safe_exec import (
 	SERVER_SCRIPT_FILE_PREFIX,
@@ -18,12 +24,14 @@ from frappe.utils.safe_exec import (
 	get_python_builtins,
 	get_safe_globals,
 	is_safe_exec_enabled,
-	safe_exec,
+	patched_qb,
 	safe_exec_flags,
 )
 from RestrictedPython import compile_restricted
 from werkzeug.routing import Rule
 
+BLOCK_DATA_CACHE_KEY = "builder_block_data"
+
 
 @dataclass
 class BlockDataKey:
@@ -66,6 +74,8 @@ class Block:
 	dynamicValues: ClassVar[list[BlockDataKey]] = []
 	blockClientScript: str = ""
 	blockDataScript: str = ""
+	cacheBlockDataScript: bool = False
+	blockDataScriptCacheTTL: int = 0
 	props: ClassVar[dict] = {}
 
 	def __init__(self, **kwargs) -> None:
@@ -133,6 +143,8 @@ class Block:
 			"dynamicValues": self.dynamicValues,
 			"blockClientScript": self.blockClientScript,
 			"blockDataScript": self.blockDataScript,
+			"cacheBlockDataScript": self.cacheBlockDataScript,
+			"blockDataScriptCacheTTL": self.blockDataScriptCacheTTL,
 			"props": self.props,
 		}
 
@@ -188,46 +200,75 @@ def remove_unsafe_fields(fields):
 	return [f for f in fields if "(" not in f]
 
 
-def get_safer_globals():
-	safe_globals = get_safe_globals()
+class FrozenNamespaceDict(NamespaceDict):
+	"""Read-only `NamespaceDict`, for namespaces shared between script executions"""
+
+	def _readonly(self, *args, **kwargs):
+		raise TypeError(f"{type(self).__name__} is read-only")
+
+	__setitem__ = __setattr__ = __delitem__ = __delattr__ = _readonly
+	update = pop = popitem = clear = setdefault = _readonly
 
+
+def get_safer_globals():
 	form_dict = getattr(frappe.local, "form_dict", frappe._dict())
 
 	if "_" in form_dict:
 		del frappe.local.form_dict["_"]
 
-	out = NamespaceDict(
+	base = get_base_safer_globals()
+
+	# only the top level namespaces are copied, everything nested in them is read-only
+	out = NamespaceDict(base)
+	out.args = form_dict
+	out.frappe = NamespaceDict(base.frappe, form_dict=form_dict)
+
+	return out
+
+
+def get_base_safer_globals() -> NamespaceDict:
+	"""
+	Everything in the script globals except `form_dict`, built once per request (and user) instead
+	of for every execution of a page or block data script.
+	"""
+	user = frappe.session.user
+	cached = getattr(frappe.local, "builder_safer_globals", None)
+	if cached and cached[0] == user:
+		return cached[1]
+
+	safe_globals = get_safe_globals()
+
+	base = NamespaceDict(
 		json=safe_globals["json"],
 		as_json=frappe.as_json,
 		dict=safe_globals["dict"],
-		args=form_dict,
 		frappe=NamespaceDict(
-			db=NamespaceDict(
+			db=FrozenNamespaceDict(
 				count=frappe.db.count,
 				exists=frappe.db.exists,
 				get_all=safe_get_all,
 				get_list=safe_get_list,
 				get_single_value=frappe.db.get_single_value,
 			),
-			form_dict=form_dict,
 			make_get_request=make_safe_get_request,
 			get_doc=get_doc_as_dict,
 			get_cached_doc=get_cached_doc_as_dict,
 			_=frappe._,
-			session=safe_globals["frappe"]["session"],
+			session=FrozenNamespaceDict(safe_globals["frappe"]["session"]),
 		),
 	)
 
-	out._write_ = safe_globals["_write_"]
-	out._getitem_ = safe_globals["_getitem_"]
-	out._getattr_ = safe_globals["_getattr_"]
-	out._getiter_ = safe_globals["_getiter_"]
-	out._iter_unpack_sequence_ = safe_globals["_iter_unpack_sequence_"]
+	base._write_ = safe_globals["_write_"]
+	base._getitem_ = safe_globals["_getitem_"]
+	base._getattr_ = safe_globals["_getattr_"]
+	base._getiter_ = safe_globals["_getiter_"]
+	base._iter_unpack_sequence_ = safe_globals["_iter_unpack_sequence_"]
 
 	# add common python builtins
-	out.update(get_python_builtins())
+	base.update(get_python_builtins())
 
-	return out
+	frappe.local.builder_safer_globals = (user, base)
+	return base
 
 
 def safer_exec(
@@ -241,19 +282,28 @@ def safer_exec(
 	if _globals:
 		exec_globals.update(_globals)
 
+	exec_compiled_script(script, exec_globals, _locals, script_filename)
+	return exec_globals, _locals
+
+
+def exec_compiled_script(script: str, exec_globals: dict, _locals: dict | None, script_filename: str | None):
+	"""Execute a script like frappe's `safe_exec` does, but with the memoized compiled code"""
 	filename = SERVER_SCRIPT_FILE_PREFIX
 	if script_filename:
 		filename += f": {frappe.scrub(script_filename)}"
 
-	with safe_exec_flags():
+	with safe_exec_flags(), patched_qb():
 		# execute script compiled by RestrictedPython
-		exec(
-			compile_restricted(script, filename=filename, policy=FrappeTransformer),
-			exec_globals,
-			_locals,
-		)
+		exec(compile_restricted_script(script, filename), exec_globals, _locals)
 
-	return exec_globals, _locals
+
+@lru_cache(maxsize=512)
+def compile_restricted_script(script: str, filename: str):
+	"""
+	Compile (and memoize) a script with RestrictedPython, so page and block data scripts are
+	compiled once per process and then only executed.
+	"""
+	return compile_restricted(script, filename=filename, policy=FrappeTransformer)
 
 
 def sync_page_templates():
@@ -384,19 +434,7 @@ def get_builder_page_preview_file_paths(page_doc):
 
 
 def is_component_used(blocks, component_id):
-	blocks = frappe.parse_json(blocks)
-	if not isinstance(blocks, list):
-		blocks = [blocks]
-
-	for block in blocks:
-		if not block:
-			continue
-		if block.get("extendedFromComponent") == component_id:
-			return True
-		elif block.get("children"):
-			return is_component_used(block.get("children"), component_id)
-
-	return False
+	return component_id in get_component_ids(blocks)
 
 
 def escape_single_quotes(text):
@@ -414,7 +452,8 @@ def camel_case_to_kebab_case(text, remove_spaces=False):
 
 def execute_script(script, _locals, script_filename):
 	if is_safe_exec_enabled():
-		safe_exec(script, None, _locals, script_filename=script_filename)
+		# `safe_exec` with frappe's safe globals, minus compiling the script on every call
+		exec_compiled_script(script, get_safe_globals(), _locals, script_filename)
 	else:
 		safer_exec(script, None, _locals, script_filename=script_filename)
 
@@ -471,6 +510,88 @@ def add_composite_index_to_web_page_view():
 	frappe.db.add_index("Web Page View", ["creation", "is_unique", "path"])
 
 
+class LRUCache:
+	"""
+	Small thread-safe, size-bounded, process-local cache.
+	Keys are namespaced by site so that one worker can serve multiple sites.
+	"""
+
+	def __init__(self, maxsize=128):
+		self.maxsize = maxsize
+		self._data = OrderedDict()
+		self._lock = threading.Lock()
+
+	def _key(self, key):
+		return (getattr(frappe.local, "site", None), key)
+
+	def get(self, key, default=None):
+		key = self._key(key)
+		with self._lock:
+			if key not in self._data:
+				return default
+			self._data.move_to_end(key)
+			return self._data[key]
+
+	def set(self, key, value):
+		key = self._key(key)
+		with self._lock:
+			self._data[key] = value
+			self._data.move_to_end(key)
+			while len(self._data) > self.maxsize:
+				self._data.popitem(last=False)
+
+	def delete(self, key):
+		with self._lock:
+			self._data.pop(self._key(key), None)
+
+	def delete_where(self, condition):
+		"""Delete all entries of the current site for which `condition(key)` is truthy"""
+		site = getattr(frappe.local, "site", None)
+		with self._lock:
+			for key in [k for k in self._data if k[0] == site and condition(k[1])]:
+				del self._data[key]
+
+	def clear(self):
+		with self._lock:
+			self._data.clear()
+
+	def __contains__(self, key):
+		return self._key(key) in self._data
+
+	def __len__(self):
+		return len(self._data)
+
+
+def get_component_ids(blocks, nested=True):
+	"""Return names of all components used in blocks, including components nested inside them"""
+	component_ids = set()
+	pending = frappe.parse_json(blocks or "[]")
+	pending = list(pending) if isinstance(pending, list) else [pending]
+
+	while pending:
+		block = pending.pop()
+		if not isinstance(block, dict):
+			continue
+		if block.get("extendedFromComponent"):
+			component_ids.add(block["extendedFromComponent"])
+		pending.extend(block.get("children") or [])
+
+	return get_nested_component_ids(component_ids) if nested else component_ids
+
+
+def get_nested_component_ids(component_ids):
+	"""Add components used inside the given components, at any depth"""
+	component_ids = set(component_ids)
+	pending = list(component_ids)
+	while pending:
+		component_block = frappe.get_cached_value("Builder Component", pending.pop(), "block")
+		for component_id in get_component_ids(component_block, nested=False) - component_ids:
+			component_ids.add(component_id)
+			pending.append(component_id)
+
+	return component_ids
+
+
 def split_styles(styles):
 	if not styles:
 		return {"regular": {}, "state": {}}
@@ -552,24 +673,7 @@ def copy_file_to_assets(source_path, file_url, assets_path, target_app="builder"
 
 def extract_components_from_blocks(blocks):
 	"""Extract component IDs from blocks recursively"""
-	components = set()
-	if not isinstance(blocks, list):
-		blocks = [blocks]
-
-	for block in blocks:
-		if isinstance(block, dict):
-			if block.get("extendedFromComponent"):
-				component_doc = frappe.get_cached_doc("Builder Component", block["extendedFromComponent"])
-				if component_doc:
-					components.update(
-						extract_components_from_blocks(frappe.parse_json(component_doc.block or "{}"))
-					)
-				components.add(block["extendedFromComponent"])
-			children = block.get("children")
-			if children and isinstance(children, list):
-				components.update(extract_components_from_blocks(children))
-
-	return components
+	return get_component_ids(blocks)
 
 
 def export_client_scripts(page_doc, client_scripts_path):
@@ -655,10 +759,111 @@ def to_safe_json(data):
 	return frappe.as_json(data)
 
 
-def execute_script_and_combine(prev_block_data, block_data_script, props):
+def execute_script_and_combine(prev_block_data, block_data_script, props, cache=False, cache_ttl=0):
 	props = frappe._dict(frappe.parse_json(props or "{}"))
+	if cache or cache_ttl:
+		block_data = get_cached_block_data(block_data_script, props, cint(cache_ttl))
+	else:
+		block_data = run_block_data_script(block_data_script, props)
+	return combine(prev_block_data, block_data)
+
+
+def run_block_data_script(block_data_script, props):
+	recorded_calls = getattr(frappe.local, "builder_block_data_calls", None)
+	call = None
+	if recorded_calls is not None:
+		# see `prefetch_block_data`
+		try:
+			call = (block_data_script, frappe.as_json(props, indent=None))
+		except TypeError:
+			pass
+		prefetched = frappe.local.builder_block_data_prefetched.pop(call, None) if call else None
+		if prefetched is not None:
+			block_data, recorded_calls[call] = prefetched
+			return block_data
+
+	start = time.monotonic()
 	block_data = frappe._dict()
 	_locals = dict(block=frappe._dict(), props=props)
 	execute_script(unescape_html(block_data_script), _locals, "sample")
 	block_data.update(_locals["block"])
-	return combine(prev_block_data, block_data)
+	if call:
+		recorded_calls[call] = time.monotonic() - start
+	return block_data
+
+
+def prefetch_block_data(calls, max_workers):
+	"""
+	Run block data script calls, `(script, props_json)` pairs, concurrently in a bounded thread pool.
+
+	Each worker gets its own site context and database connection, so scripts waiting on queries
+	overlap. Results are `(block data, seconds the script took)` pairs. Failed calls are left out,
+	the render runs (and raises for) them itself.
+	"""
+	site, sites_path = frappe.local.site, frappe.local.sites_path
+	user, lang = frappe.session.user, getattr(frappe.local, "lang", None)
+	request = getattr(frappe.local, "request", None)
+	form_dict = frappe._dict(getattr(frappe.local, "form_dict", None) or {})
+
+	def run(call):
+		frappe.init(site, sites_path=sites_path)
+		try:
+			frappe.connect()
+			frappe.set_user(user)
+			frappe.local.lang = lang
+			frappe.local.request = request
+			frappe.local.form_dict = frappe._dict(form_dict)
+			block_data_script, props_json = call
+			start = time.monotonic()
+			block_data = run_block_data_script(block_data_script, frappe._dict(frappe.parse_json(props_json)))
+			return block_data, time.monotonic() - start
+		finally:
+			frappe.destroy()
+
+	prefetched = {}
+	with ThreadPoolExecutor(max_workers=min(max_workers, len(calls))) as executor:
+		futures = {call: executor.submit(run, call) for call in calls}
+		for call, future in futures.items():
+			try:
+				prefetched[call] = future.result()
+			except Exception:
+				pass
+	return prefetched
+
+
+def get_cached_block_data(block_data_script, props, cache_ttl=0):
+	"""
+	Run a block data script once per request for the same script and props, e.g. for every
+	instance of a repeated block. With `cache_ttl` the result is also kept in redis for that many
+	seconds, per user and query string.
+	"""
+	try:
+		props_json = frappe.as_json(props, indent=None)
+	except TypeError:
+		# props which can't be serialized can't be part of the key either
+		return run_block_data_script(block_data_script, props)
+
+	user = frappe.session.user
+	key = hashlib.sha256(f"{block_data_script}\0{props_json}".encode()).hexdigest()
+
+	request_cache = getattr(frappe.local, "builder_block_data", None)
+	if request_cache is None:
+		request_cache = frappe.local.builder_block_data = {}
+	if (user, key) in request_cache:
+		return request_cache[(user, key)]
+
+	if cache_ttl:
+		form_dict_json = frappe.as_json(getattr(frappe.local, "form_dict", None) or {}, indent=None)
+		redis_key = "{}::{}".format(
+			BLOCK_DATA_CACHE_KEY,
+			hashlib.sha256(f"{key}\0{user}\0{form_dict_json}".encode()).hexdigest(),
+		)
+		block_data = frappe.cache.get_value(redis_key)
+		if block_data is None:
+			block_data = run_block_data_script(block_data_script, props)
+			frappe.cache.set_value(redis_key, block_data, expires_in_sec=cache_ttl)
+	else:
+		block_data = run_block_data_script(block_data_script, props)
+
+	request_cache[(user, key)] = block_data
+	return block_data
@@ -45,6 +45,8 @@ class Block implements BlockOptions {
 	dynamicValues: Array<BlockDataKey>;
 	blockClientScript?: string;
 	blockDataScript?: string;
+	cacheBlockDataScript?: boolean;
+	blockDataScriptCacheTTL?: number;
 	props?: BlockProps;
 	// @ts-expect-error
 	referenceComponent: Block | null;
@@ -111,6 +113,8 @@ class Block implements BlockOptions {
 		this.dynamicValues = reactive(options.dynamicValues || []);
 		this.blockClientScript = options.blockClientScript || "";
 		this.blockDataScript = options.blockDataScript || "";
+		this.cacheBlockDataScript = options.cacheBlockDataScript || false;
+		this.blockDataScriptCacheTTL = options.blockDataScriptCacheTTL || 0;
 		this.props = reactive(options.props || {});
 
 		this.blockName = options.blockName;
@@ -992,6 +996,23 @@ class Block implements BlockOptions {
 	setBlockDataScript(script: string) {
 		this.blockDataScript = script;
 	}
+	getBlockDataScriptCache(): { cache: boolean; ttl: number } {
+		if (this.isExtendedFromComponent() && !this.blockDataScript) {
+			return this.referenceComponent?.getBlockDataScriptCache() || { cache: false, ttl: 0 };
+		}
+		return { cache: Boolean(this.cacheBlockDataScript), ttl: this.blockDataScriptCacheTTL || 0 };
+	}
+	canSetBlockDataScriptCache(): boolean {
+		// component instances use the cache settings of the script they run
+		return !(this.isExtendedFromComponent() && !this.blockDataScript);
+	}
+	setBlockDataScriptCache(cache: boolean, ttl: number = 0) {
+		if (!this.canSetBlockDataScriptCache()) {
+			return;
+		}
+		this.cacheBlockDataScript = cache;
+		this.blockDataScriptCacheTTL = cache ? Math.max(ttl, 0) : 0;
+	}
 	getBlockProps(): BlockProps {
 		let blockProps = {};
 		if (this.isExtendedFromComponent() && !Object.keys(this.props || {}).length) {
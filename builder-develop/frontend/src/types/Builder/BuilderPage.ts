@@ -1,4 +1,5 @@
 import { BuilderPageClientScript } from "./BuilderPageClientScript";
+import { BuilderPageComponent } from "./BuilderPageComponent";
 
 export interface BuilderPage {
 	creation: string;
@@ -33,6 +34,10 @@ export interface BuilderPage {
 <br>
 <b>Note:</b> Each key value of data should be a list.	*/
 	page_data_script?: string;
+	/**	Cache Data For (Seconds) : Int - Page data script result is cached for this many seconds, separately for each set of route variables. 0 disables caching.	*/
+	page_data_cache_ttl?: number;
+	/**	Data Cache Keys : Data - Comma separated query params the page data depends on, e.g. <code>page, category</code>	*/
+	page_data_cache_keys?: string;
 	/**	Head HTML : Code - This will be appended at the end of the &lt;head&gt;	*/
 	head_html?: string;
 	/**	Body HTML : Code - This will be appended at the end of the &lt;body&gt;	*/
@@ -60,4 +65,6 @@ You can generate using favicon-generator.org	*/
 	disable_indexing?: 0 | 1;
 	/**	Project Folder : Link - Builder Project Folder	*/
 	project_folder?: string;
+	/**	Components : Table - Builder Page Component - Components used in the page blocks and draft, nested ones included. Set automatically.	*/
+	components?: BuilderPageComponent[];
 }
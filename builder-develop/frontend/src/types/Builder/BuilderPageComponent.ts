@@ -0,0 +1,15 @@
+
+export interface BuilderPageComponent{
+	creation: string
+	name: string
+	modified: string
+	owner: string
+	modified_by: string
+	docstatus: 0 | 1 | 2
+	parent?: string
+	parentfield?: string
+	parenttype?: string
+	idx?: number
+	/**	Component : Data	*/
+	component: string
+}
\ No newline at end of file
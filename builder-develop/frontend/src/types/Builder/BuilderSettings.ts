@@ -34,4 +34,10 @@ export interface BuilderSettings{
 	execute_block_scripts_in_editor?: "Don't Execute" | "Restricted" | "Unrestricted"
 	/**	Prevent Click Emulation : Check - Prevents click events from being emulated in the editor for blocks with Block Client Scripts.	*/
 	restrict_click_handlers?: 0 | 1
+	/**	Use Fast HTML Renderer : Check - Build page HTML without BeautifulSoup. Output is identical, large pages compile much faster.	*/
+	use_fast_html_renderer?: 0 | 1
+	/**	Stream Page Response : Check - Send the page head right away and stream the body while it renders.	*/
+	stream_page_response?: 0 | 1
+	/**	Block Data Script Workers : Int - Number of block data scripts to run concurrently, each with its own database connection. 0 runs them one after another.	*/
+	block_data_script_workers?: number
 }
\ No newline at end of file